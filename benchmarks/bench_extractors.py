@@ -0,0 +1,127 @@
+"""
+MWS response parsing benchmark
+
+Compares pairs.parsers (DictWrapper walking) with pairs.extractors (compiled XPath on raw xml)
+on generated batch responses, checks that both give equal results. Run from the project root:
+
+    python benchmarks/bench_extractors.py [batches] [settings module]
+"""
+
+import sys
+
+from os import environ
+from random import Random
+from timeit import timeit
+
+import django
+
+sys.path.insert(0, '.')
+environ.setdefault('DJANGO_SETTINGS_MODULE', sys.argv[2] if len(sys.argv) > 2 else 'config.settings.local')
+django.setup()
+
+from mws.mws import DictWrapper
+
+from config import constants
+from pairs.extractors import extract_competitive_prices, extract_lowest_offer_prices
+from pairs.parsers import get_buybox_price_from_response, get_no_buybox_price_from_response
+
+random = Random(0)
+batch_size = constants.amazon_get_my_price_items_limit
+
+price_xml = '<Price><LandedPrice><CurrencyCode>USD</CurrencyCode><Amount>{0:.2f}</Amount></LandedPrice>' \
+            '<ListingPrice><CurrencyCode>USD</CurrencyCode><Amount>{0:.2f}</Amount></ListingPrice></Price>'
+
+
+def competitive_price_xml(price_id: int) -> str:
+    return '<CompetitivePrice belongsToRequester="{0}" condition="New" subcondition="New">' \
+           '<CompetitivePriceId>{1}</CompetitivePriceId>{2}</CompetitivePrice>'.format(
+               random.choice(('true', 'false')), price_id, price_xml.format(random.uniform(5, 100)))
+
+
+def competitive_pricing_response(asins: list) -> str:
+    results = []
+
+    for asin in asins:
+        prices = ''.join(competitive_price_xml(price_id) for price_id in random.sample((1, 2), random.randint(0, 2)))
+
+        results.append(
+            '<GetCompetitivePricingForASINResult ASIN="{0}" status="Success"><Product><Identifiers>'
+            '<MarketplaceASIN><MarketplaceId>ATVPDKIKX0DER</MarketplaceId><ASIN>{0}</ASIN></MarketplaceASIN>'
+            '</Identifiers><CompetitivePricing><CompetitivePrices>{1}</CompetitivePrices></CompetitivePricing>'
+            '</Product></GetCompetitivePricingForASINResult>'.format(asin, prices)
+        )
+
+    return '<GetCompetitivePricingForASINResponse xmlns="{0}">{1}</GetCompetitivePricingForASINResponse>'.format(
+        constants.amazon_products_namespace, ''.join(results))
+
+
+def lowest_offer_listings_response(asins: list) -> str:
+    results = []
+
+    for asin in asins:
+        listings = ''.join('<LowestOfferListing>{0}</LowestOfferListing>'.format(
+            price_xml.format(random.uniform(5, 100))) for _ in range(random.randint(0, 3)))
+
+        results.append(
+            '<GetLowestOfferListingsForASINResult ASIN="{0}" status="Success"><Product>'
+            '<LowestOfferListings>{1}</LowestOfferListings></Product>'
+            '</GetLowestOfferListingsForASINResult>'.format(asin, listings)
+        )
+
+    return '<GetLowestOfferListingsForASINResponse xmlns="{0}">{1}</GetLowestOfferListingsForASINResponse>'.format(
+        constants.amazon_products_namespace, ''.join(results))
+
+
+def parse_buybox(responses: list) -> list:
+    result = []
+
+    for asins, xml in responses:
+        price_info = [[asin] for asin in asins]
+        get_buybox_price_from_response(price_info, DictWrapper(xml, 'GetCompetitivePricingForASINResult'))
+        result += [tuple(asin_info) for asin_info in price_info]
+
+    return result
+
+
+def extract_buybox(responses: list) -> list:
+    return [row[:3] for _, xml in responses for row in extract_competitive_prices(xml)]
+
+
+def parse_no_buybox(responses: list) -> list:
+    result = []
+
+    for asins, xml in responses:
+        asins_no_buybox = list(asins)
+        get_no_buybox_price_from_response(asins_no_buybox, DictWrapper(xml, 'GetLowestOfferListingsForASINResult'))
+        result += asins_no_buybox
+
+    return result
+
+
+def extract_no_buybox(responses: list) -> list:
+    return [row[:2] for _, xml in responses for row in extract_lowest_offer_prices(xml)]
+
+
+def main(batches: int = 200) -> None:
+    asins = [['B{0:09d}'.format(batch * batch_size + i) for i in range(batch_size)] for batch in range(batches)]
+
+    cases = (
+        ('GetCompetitivePricingForASIN', [(part, competitive_pricing_response(part)) for part in asins],
+         parse_buybox, extract_buybox),
+        ('GetLowestOfferListingsForASIN', [(part, lowest_offer_listings_response(part)) for part in asins],
+         parse_no_buybox, extract_no_buybox),
+    )
+
+    for operation, responses, parse, extract in cases:
+        assert parse(responses) == extract(responses), 'Different results for {0}'.format(operation)
+
+        parse_time = timeit(lambda: parse(responses), number=3) / 3
+        extract_time = timeit(lambda: extract(responses), number=3) / 3
+
+        print('{0:<32} items: {1}, parsers: {2:.3f} s, extractors: {3:.3f} s, speedup: {4:.1f}x'.format(
+            operation, batches * batch_size, parse_time, extract_time, parse_time / extract_time
+        ))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
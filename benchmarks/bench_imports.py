@@ -0,0 +1,67 @@
+"""
+Import-time benchmark
+
+Measures cold import time of project modules in fresh interpreters and checks that
+api clients, xml helpers and finders are not created at import. Run from the project root:
+
+    python benchmarks/bench_imports.py [settings module] [runs]
+"""
+
+import subprocess
+import sys
+
+from os import environ
+from statistics import median
+
+from unipath import Path
+
+base_dir = Path(__file__).absolute().ancestor(2)
+
+modules = ['utils', 'pairs.helpers', 'pairs.tasks', 'repricer.tasks', 'finder.helpers']
+
+singletons = [
+    'secret_dict', 'quota_limiter', 'ebay_trading_api', 'ebay_shopping_api', 'amazon_products_api',
+    'amazon_orders_api', 'amazon_feeds_api', 'xml_quantity_helper', 'xml_product_helper', 'xml_price_helper',
+    'xml_delete_product_helper'
+]
+
+script = '''
+from time import perf_counter
+start = perf_counter()
+import django
+django.setup()
+setup = perf_counter()
+import {module}
+end = perf_counter()
+import utils
+initialized = ','.join(name for name in {singletons!r} if getattr(utils, name).is_initialized)
+print(setup - start, end - setup, initialized, sep=';')
+'''
+
+
+def measure(module: str, settings: str) -> tuple:
+    """ Import module in a new interpreter, return (django setup time, import time, initialized singletons) """
+
+    result = subprocess.run([sys.executable, '-c', script.format(module=module, singletons=singletons)],
+                            cwd=base_dir, env=dict(environ, DJANGO_SETTINGS_MODULE=settings),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    setup, duration, initialized = result.stdout.strip().splitlines()[-1].split(';')
+
+    return float(setup), float(duration), initialized
+
+
+def main(settings: str = 'config.settings.local', runs: int = 5) -> None:
+    print('{0:<16} {1:>10} {2:>10}  {3}'.format('module', 'setup, s', 'import, s', 'initialized at import'))
+
+    for module in modules:
+        results = [measure(module, settings) for _ in range(runs)]
+
+        print('{0:<16} {1:>10.3f} {2:>10.3f}  {3}'.format(
+            module, median(result[0] for result in results), median(result[1] for result in results),
+            results[-1][2] or '-'
+        ))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2], *[int(arg) for arg in sys.argv[2:3]])
@@ -0,0 +1,90 @@
+"""
+Profit engine benchmark
+
+Calculates Amazon prices for random eBay price vectors by ProfitEngine and by the per-price
+interval scan, checks that results are equal and compares the time. Run from the project root:
+
+    python benchmarks/bench_profit.py [vectors] [eBay ids per pair]
+"""
+
+import sys
+
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, '.')
+
+from config import constants
+from pairs.profit import profit_engine
+
+
+def check_profit_scan(amazon_price: float, ebay_prices: list) -> tuple:
+    """ Per-price interval scan, the calculation replaced by ProfitEngine """
+
+    prices, chosen_ebay_prices = [], []
+
+    for ebay_price in ebay_prices:
+        if not ebay_price:
+            continue
+
+        price = 0
+
+        for interval in constants.profit_intervals:
+            if interval[0] <= ebay_price < interval[1]:
+                price = ebay_price * constants.profit_intervals[interval] / constants.profit_percentage
+                prices.append(price)
+                chosen_ebay_prices.append(ebay_price)
+                break
+
+        if amazon_price and price + constants.profit_buffer >= amazon_price:
+            return False, None, None
+
+    if not len(prices):
+        return False, None, None
+
+    max_ebay_price_coeff = 0
+    max_price = max(prices)
+    max_ebay_price = chosen_ebay_prices[prices.index(max_price)]
+
+    for interval in constants.amazon_approximate_price_percent:
+        if interval[0] <= max_ebay_price < interval[1]:
+            max_ebay_price_coeff = constants.amazon_approximate_price_percent[interval]
+
+    return True, round(min(prices), 2), round(max_price + max_ebay_price * max_ebay_price_coeff, 2)
+
+
+def main(vectors: int = 1000000, ids: int = constants.ebay_ids_max_count) -> None:
+    random = np.random.RandomState(0)
+
+    # cent prices with missing eBay ids (zeros) and a part of unknown Amazon prices
+
+    ebay_prices = np.round(random.uniform(0.01, 80, (vectors, ids)), 2)
+    ebay_prices[random.uniform(size=(vectors, ids)) < 0.3] = 0
+    amazon_prices = np.round(random.uniform(1, 150, vectors), 2)
+    amazon_prices[random.uniform(size=vectors) < 0.2] = 0
+
+    start = perf_counter()
+    checked, minimum_prices, approximate_prices = profit_engine.check_profits(amazon_prices, ebay_prices)
+    engine_time = perf_counter() - start
+
+    start = perf_counter()
+    results = [check_profit_scan(amazon_price, list(prices)) for amazon_price, prices in
+               zip(amazon_prices.tolist(), ebay_prices.tolist())]
+    scan_time = perf_counter() - start
+
+    for index, result in enumerate(results):
+        engine_result = (True, minimum_prices[index], approximate_prices[index]) if checked[index] else \
+            (False, None, None)
+
+        assert result == engine_result, 'Different results for {0}: {1} != {2}'.format(
+            ebay_prices[index], result, engine_result
+        )
+
+    print('vectors: {0}, eBay ids: {1}, scan: {2:.2f} s, engine: {3:.2f} s, speedup: {4:.0f}x'.format(
+        vectors, ids, scan_time, engine_time, scan_time / engine_time
+    ))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
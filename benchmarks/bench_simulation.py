@@ -0,0 +1,60 @@
+"""
+Repricer simulation benchmark
+
+Writes random price history of given size into a temporary directory and replays it through every
+repricing strategy. Run from the project root:
+
+    python benchmarks/bench_simulation.py [items] [snapshots]
+"""
+
+import sys
+
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, '.')
+
+from repricer.simulation import PriceHistory, simulate
+from repricer.strategies import strategies
+
+
+def write_history(directory: str, items: int, snapshots: int) -> None:
+    """ Random walk competitor prices around items approximate prices """
+
+    random = np.random.RandomState(0)
+    arrays = PriceHistory.create(directory, snapshots, items)
+    minimum_prices = random.uniform(5, 100, items).round(2)
+    approximate_prices = (minimum_prices * random.uniform(1.05, 1.3, items)).round(2)
+    prices = approximate_prices.copy()
+
+    arrays['minimum_prices'][:] = minimum_prices
+    arrays['approximate_prices'][:] = approximate_prices
+    arrays['current_prices'][:] = approximate_prices
+
+    for snapshot in range(snapshots):
+        prices = np.maximum(prices + random.choice([-0.5, 0, 0, 0.5], items), 1).round(2)
+        arrays['prices'][snapshot] = prices
+        arrays['buybox'][snapshot] = random.choice([-1, 0, 1], items, p=[0.1, 0.6, 0.3])
+
+    for array in arrays.values():
+        array.flush()
+
+
+def main(items: int = 100000, snapshots: int = 24 * 14) -> None:
+    with TemporaryDirectory() as directory:
+        start = perf_counter()
+        write_history(directory, items, snapshots)
+        print('History: {0} items x {1} snapshots, written in {2:.1f} s'.format(items, snapshots,
+                                                                               perf_counter() - start))
+        history = PriceHistory(directory)
+
+        for number, strategy in sorted(strategies.items()):
+            print(number, simulate(history, strategy))
+
+        del history
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
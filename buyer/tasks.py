@@ -183,6 +183,8 @@ def build_purchase_condition(ebay_ids, total_quantity):
     ebay_ids_prices, ebay_ids_counts = {}, {}
 
     for ebay_id in ebay_ids:
+        ebay_trading_api.acquire('GetItem')
+
         try:
             response = ebay_trading_api.api.execute('GetItem', {'ItemID': ebay_id})
 
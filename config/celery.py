@@ -35,8 +35,23 @@ task_routes = {
         'routing_key': 'workflow',
     },
 
+    'pairs.tasks.workflow_step': {
+        'queue': 'workflow',
+        'routing_key': 'workflow',
+    },
+
+    'pairs.tasks.workflow_poll': {
+        'queue': 'workflow',
+        'routing_key': 'workflow',
+    },
+
     'repricer.tasks.reprice': {
         'queue': 'repricer',
         'routing_key': 'repricer',
+    },
+
+    'repricer.tasks.scheduled_reprice': {
+        'queue': 'repricer',
+        'routing_key': 'repricer',
     }
 }
@@ -5,6 +5,7 @@ from math import inf
 # file paths
 base_dir = Path(__file__).absolute().ancestor(2)
 secret_filename = base_dir.child('config').child('secret.json')
+quota_db_filename = base_dir.child('quota.sqlite3')
 xml_header_filename = base_dir.child('templates_xml').child('header.xml')
 xml_message_quantity_filename = base_dir.child('templates_xml').child('message_quantity.xml')
 xml_message_product_filename = base_dir.child('templates_xml').child('message_product.xml')
@@ -38,6 +39,8 @@ reason_message_max_length = 100
 owner_on_delete_id = 1
 order_id_length = 19
 na_seller_id_length = 50
+workflow_step_length = 20
+sync_cursor_name_length = 20
 
 # pairs views
 on_page_obj_number = 40
@@ -58,6 +61,7 @@ ebay_min_feedback_score = 1000
 ebay_min_positive_percentage = 98.0
 profit_percentage = 0.85
 profit_buffer = 1
+round_tie_tolerance = 1e-6  # distance to a rounding tie to recalculate by Python round
 min_order_owner_profit = 0.5
 
 profit_intervals = {
@@ -78,9 +82,31 @@ amazon_approximate_price_percent = {
 # pairs tasks
 pair_unsuitable_days_live = 7
 amazon_workflow_delay = 180  # seconds
+workflow_stale_timeout = 14400  # seconds without state changes to resume the run
 check_after_delay = 3600  # seconds
+orders_first_sync_days = 3  # orders sync depth without stored cursor
 price_digits = 3
 requests_timeout = 60
+requests_retries = 3
+requests_backoff = 0.5  # seconds, doubled after every retry
+requests_retry_statuses = 429, 500, 502, 503, 504
+requests_pool_size = 10  # keep-alive connections per host
+requests_workers = 8  # threads for concurrent page requests
+bulk_batch_size = 500
+app_prices_batch_size = 200  # pairs per empty_app_prices command batch
+delete_chunk_size = 5000  # primary key range size for chunked deletes
+
+# pairs feeds
+amazon_feed_max_messages = 5000  # messages per feed chunk
+amazon_feed_max_size = 10485760  # bytes
+amazon_feed_chunk_tries = 2
+amazon_feed_done_statuses = '_DONE_', '_CANCELLED_'
+amazon_feed_poll_batch = 100  # max ids per GetFeedSubmissionList request
+amazon_feed_poll_min_delay = 10  # seconds
+amazon_feed_poll_max_delay = 300  # seconds
+amazon_feed_poll_backoff = 2
+amazon_feed_poll_jitter = 0.2
+amazon_feed_wait_timeout = 5400  # seconds
 
 # pairs parsers
 
@@ -119,12 +145,58 @@ token_expiration_hours = 4
 # utils
 con_tries = 5
 con_delay = 5  # seconds
-ebay_trading_api_calls_number = 5000
-amazon_product_api_calls_number = 18000
 amazon_get_price_limit = 200  # requests per hour
 amazon_get_price_delay = 3600
 amazon_get_my_price_items_limit = 20  # max asins per request
+amazon_price_workers = 4
+ebay_price_workers = 8
+amazon_price_cache_alias = 'default'
+amazon_price_cache_ttl = 600  # seconds
+amazon_price_cache_wait_timeout = 120  # seconds
+quota_db_timeout = 30  # seconds to wait for the quota database lock
+quota_max_sleep = 5  # seconds between quota checks of blocked acquire
+web_quota_timeout = 10  # max seconds to wait for api quota in web requests
+mws_throttle_tries = 5
+mws_throttle_delay = 2  # seconds
+mws_throttle_max_delay = 60  # seconds
+mws_throttle_jitter = 0.2
+mws_throttle_codes = 'RequestThrottled', 'QuotaExceeded'
+
+# share of every quota limit available for the priority class
+api_priorities = {
+    'high': 1.0,  # web requests
+    'normal': 0.9,  # workflow and repricer
+    'low': 0.7  # finder
+}
+
+# sliding-window limits: (max calls or items, window in seconds)
+amazon_products_limits = (20, 2), (36000, 3600)
+
+api_quota_limits = {
+    'ebay-trading': {
+        'GetItem': ((5000, 86400),)
+    },
+    'amazon-products': {
+        'GetCompetitivePricingForASIN': amazon_products_limits,
+        'GetLowestOfferListingsForASIN': amazon_products_limits,
+        'GetMyPriceForASIN': amazon_products_limits,
+        'GetMyPriceForSKU': amazon_products_limits,
+        'GetMatchingProductForId': ((20, 4), (18000, 3600))
+    },
+    'amazon-orders': {
+        'ListOrders': ((6, 360),),
+        'ListOrdersByNextToken': ((6, 360),),
+        'ListOrderItems': ((30, 60),),
+        'ListOrderItemsByNextToken': ((30, 60),)
+    },
+    'amazon-feeds': {
+        'SubmitFeed': ((15, 1800),),
+        'GetFeedSubmissionList': ((10, 450),),
+        'GetFeedSubmissionResult': ((15, 900),)
+    }
+}
 amazon_region = 'US'
+amazon_products_namespace = 'http://mws.amazonservices.com/schema/Products/2011-10-01'
 
 amazon_feed_types = {
     'quantity': '_POST_INVENTORY_AVAILABILITY_DATA_',
@@ -214,6 +286,20 @@ us_states_abbr = {
 
 # repricer tasks
 old_stats_days_live = 5
+price_snapshots_brin_pages = 32
+price_history_raw_days = 2  # snapshots are downsampled to one per pair and hour after that
+price_history_days = 60  # snapshots retention
+price_history_export_step = 3600  # seconds between exported snapshots
+reprice_unchanged_days = 1  # items with older last snapshots are repriced even if their market did not change
+reprice_tier_intervals = {0: 900, 1: 3600, 2: 14400}  # seconds between repricing of hot, warm and cold items
+reprice_tier_days = 7  # orders and price history depth for tiers assignment
+reprice_hot_orders = 1  # orders number to make an item hot
+reprice_hot_churn = 4  # buybox status changes to make an item hot
+reprice_warm_churn = 1
+reprice_hot_volatility = 0.05  # competitor price standard deviation to mean ratio
+reprice_warm_volatility = 0.01
+reprice_hourly_budget = 24000  # ASINs per hour for scheduled repricing, part of GetCompetitivePricingForASIN quota
+reprice_scheduler_interval = 300  # seconds between scheduler runs
 
 # logs helpers
 return_last_n_lines = 300
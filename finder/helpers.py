@@ -1,15 +1,15 @@
 import logging
 
 from config import constants
-from utils import ebay_trading_api, secret_dict
+from utils import ebay_trading_api, secret_dict, LazyObject
 from decorators import log_work_time
-from pairs.helpers import check_profit
+from pairs.profit import profit_engine
 from pairs.parsers import get_ebay_price_from_response, get_ebay_quantity_from_response
 from .interface import AmazonFinder, KeepaFinder
 
 logger = logging.getLogger('finder')
-am_finder = AmazonFinder()
-keepa_finder = KeepaFinder(secret_dict['keepa_key'])
+am_finder = LazyObject(AmazonFinder)
+keepa_finder = LazyObject(lambda: KeepaFinder(secret_dict['keepa_key']))
 
 
 @log_work_time('Run finder task')
@@ -42,6 +42,10 @@ def run_finder(uri: str, use_proxy: bool, save: bool = False, username: str = 'a
         ebay_price = []
 
         for ebay_id in info_results[asin]['ebay_ids']:
+            if not ebay_trading_api.acquire('GetItem', priority='low', block=False):
+                logger.warning('eBay api GetItem calls number is over, finder stopped.')
+                break
+
             try:
                 response = ebay_trading_api.api.execute('GetItem', {'ItemID': ebay_id})
 
@@ -66,7 +70,7 @@ def run_finder(uri: str, use_proxy: bool, save: bool = False, username: str = 'a
         # check profits
 
         profit_check, amazon_minimum_price, amazon_approximate_price = \
-            check_profit(info_results[asin]['price'], ebay_price)
+            profit_engine.check_profit(info_results[asin]['price'], ebay_price)
 
         if not profit_check:
             continue
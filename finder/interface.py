@@ -11,10 +11,10 @@ from datetime import datetime, timedelta
 from re import sub, search
 
 from config import constants
-from pairs.helpers import get_item_price_info
+from pairs.helpers import iter_item_price_info
 from pairs.parsers import parse_delivery_time_response
 from decorators import log_work_time
-from utils import secret_dict
+from utils import secret_dict, api_priority
 
 CURRENT_AMAZON_LOCATION = 'Ukraine'
 
@@ -454,8 +454,10 @@ class AmazonFinder(object):
     def _get_prices(self) -> None:
         """ Receive lowest prices for products """
 
-        for price in get_item_price_info(self._asins, logger):
-            self._products[price[0]]['price'] = price[1]
+        with api_priority('low'):
+            for price_info in iter_item_price_info(self._asins, logger):
+                for price in price_info:
+                    self._products[price[0]]['price'] = price[1]
 
 
 class KeepaFinder(object):
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.db.models import F
 from re import fullmatch
-from .models import Pair, Order, CustomUser, NotAllowedSeller
+from .models import Pair, Order, CustomUser, NotAllowedSeller, WorkflowRun, SyncCursor
 
 
 def make_pairs_unchecked(_, __, queryset):
@@ -36,6 +36,16 @@ set_status_4.short_description = 'Mark selected pairs as unsuitable (4 - Cannot
 set_status_6.short_description = 'Mark selected pairs as unsuitable (6 - Closed by owner)'
 
 
+def step_duration(step):
+    """ Create WorkflowRun list column with the step duration """
+
+    def duration(run):
+        return run.get_step_duration(step)
+
+    duration.short_description = '{0}, s'.format(step)
+    return duration
+
+
 class PairInline(admin.TabularInline):
     model = Order.items.through
 
@@ -117,3 +127,17 @@ class OrderAdmin(admin.ModelAdmin):
 class NASellerAdmin(admin.ModelAdmin):
     search_fields = 'ebay_user_id',
     ordering = 'ebay_user_id',
+
+
+@admin.register(WorkflowRun)
+class WorkflowRunAdmin(admin.ModelAdmin):
+    readonly_fields = 'created', 'updated', 'steps_times'
+    list_display = ('__str__', 'created', 'finished') + tuple(step_duration(step) for step in WorkflowRun.steps[:-1])
+    list_filter = 'step', 'reconciled'
+    ordering = '-created',
+
+
+@admin.register(SyncCursor)
+class SyncCursorAdmin(admin.ModelAdmin):
+    readonly_fields = 'updated',
+    list_display = 'name', 'position', 'updated'
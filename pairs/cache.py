@@ -0,0 +1,123 @@
+from django.core.cache import caches
+
+from threading import Event, Lock
+
+from config import constants
+
+
+class PriceInfoCache(object):
+    """
+    Read-through cache of Amazon items price info, keyed by ASIN
+
+    Concurrent callers asking for the same ASIN are coalesced: the first one requests it
+    from the api, others wait for its result instead of making their own request
+    """
+
+    def __init__(self,
+                 alias: str = constants.amazon_price_cache_alias,
+                 ttl: int = constants.amazon_price_cache_ttl,
+                 wait_timeout: float = constants.amazon_price_cache_wait_timeout):
+        """
+        PriceInfoCache initialization
+
+        :param alias: Django cache alias from CACHES setting
+        :param ttl: cached price info lifetime in seconds
+        :param wait_timeout: max seconds to wait for the in-flight request of other caller
+        """
+
+        self._alias = alias
+        self._ttl = ttl
+        self._wait_timeout = wait_timeout
+        self._in_flight = {}
+        self._lock = Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+
+    @property
+    def cache(self):
+        return caches[self._alias]
+
+    @staticmethod
+    def key(asin: str) -> str:
+        return 'price_info:{0}'.format(asin)
+
+    def _count(self, **values) -> None:
+        with self._lock:
+            for name, value in values.items():
+                self._stats[name] += value
+
+    def get_many(self, asins: list) -> list:
+        """ Get cached price info list for given ASINs, list element format: [asin, lowest price, is_buybox_winner] """
+
+        if not len(asins):
+            return []
+
+        cached = self.cache.get_many([self.key(asin) for asin in asins])
+        return [[asin] + cached[self.key(asin)] for asin in asins if self.key(asin) in cached]
+
+    def set_many(self, price_info: list) -> None:
+        """ Cache complete elements of price info list """
+
+        self.cache.set_many({
+            self.key(asin_info[0]): asin_info[1:] for asin_info in price_info if len(asin_info) == 3
+        }, self._ttl)
+
+    def lookup(self, asins: list) -> tuple:
+        """
+        Split ASINs into cached, own and in-flight ones, own ASINs must be requested by the caller
+        and released after that
+
+        :return: tuple: (cached price info list, list of own ASINs, list of in-flight ASINs)
+        """
+
+        cached = self.get_many(asins)
+        cached_asins = {asin_info[0] for asin_info in cached}
+        own, in_flight = [], []
+
+        with self._lock:
+            for asin in asins:
+                if asin in cached_asins:
+                    continue
+
+                if asin in self._in_flight:
+                    in_flight.append(asin)
+
+                else:
+                    self._in_flight[asin] = Event()
+                    own.append(asin)
+
+        self._count(hits=len(cached), misses=len(own), coalesced=len(in_flight))
+        return cached, own, in_flight
+
+    def release(self, asins: list) -> None:
+        """ Mark own ASINs requests as finished, waiting callers read results from cache """
+
+        with self._lock:
+            events = [self._in_flight.pop(asin) for asin in asins if asin in self._in_flight]
+
+        for event in events:
+            event.set()
+
+    def wait(self, asins: list) -> list:
+        """ Wait for in-flight requests of given ASINs, return their cached price info list """
+
+        with self._lock:
+            events = [self._in_flight.get(asin) for asin in asins]
+
+        for event in events:
+            if event is not None:
+                event.wait(self._wait_timeout)
+
+        return self.get_many(asins)
+
+    def stats(self) -> dict:
+        """ Get cache hits, misses, coalesced requests numbers and hit ratio """
+
+        with self._lock:
+            stats = dict(self._stats)
+
+        total = stats['hits'] + stats['misses'] + stats['coalesced']
+        stats['hit_ratio'] = round((stats['hits'] + stats['coalesced']) / total, 3) if total else None
+        return stats
+
+
+price_info_cache = PriceInfoCache()
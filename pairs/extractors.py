@@ -0,0 +1,120 @@
+from lxml import etree
+
+from config import constants
+
+# Raw xml extractors for Amazon Products api batch responses, every extractor returns list of flat tuples
+# (asin, price, is_buybox_winner, rank) in the response results order, fields not provided by the operation are None
+
+namespaces = {'p': constants.amazon_products_namespace}
+xml_parser = etree.XMLParser(remove_blank_text=True, resolve_entities=False)
+
+
+def xpath(path: str) -> etree.XPath:
+    return etree.XPath(path, namespaces=namespaces, smart_strings=False)
+
+
+competitive_pricing_results = xpath('//p:GetCompetitivePricingForASINResult')
+lowest_offer_listings_results = xpath('//p:GetLowestOfferListingsForASINResult')
+my_price_results = xpath('//p:GetMyPriceForASINResult')
+matching_product_results = xpath('//p:GetMatchingProductForIdResult')
+
+competitive_prices = xpath('p:Product/p:CompetitivePricing/p:CompetitivePrices/p:CompetitivePrice')
+competitive_price_id = xpath('string(p:CompetitivePriceId)')
+lowest_offer_listings = xpath('p:Product/p:LowestOfferListings/p:LowestOfferListing')
+first_offer = xpath('p:Product/p:Offers/p:Offer[1]')
+first_rank = xpath('string(p:Products/p:Product/p:SalesRankings/p:SalesRank[1]/p:Rank)')
+
+landed_price = xpath('string(p:Price/p:LandedPrice/p:Amount)')
+listing_price = xpath('string(p:Price/p:ListingPrice/p:Amount)')
+buying_landed_price = xpath('string(p:BuyingPrice/p:LandedPrice/p:Amount)')
+buying_listing_price = xpath('string(p:BuyingPrice/p:ListingPrice/p:Amount)')
+
+
+def get_tree(xml: (str, bytes)) -> etree._Element:
+    """ Parse raw response, mws keeps xml responses as decoded text """
+
+    if isinstance(xml, str):
+        xml = xml.encode(constants.load_encoding)
+
+    return etree.fromstring(xml, xml_parser)
+
+
+def get_amount(elements: list, *paths) -> float:
+    """ Min price of elements by the first path that exists in all of them, 0 if there is no such path """
+
+    for path in paths:
+        try:
+            return min(float(path(element)) for element in elements)
+
+        except ValueError:
+            continue
+
+    return 0
+
+
+def extract_competitive_prices(xml: (str, bytes)) -> list:
+    """ Get buybox prices from GetCompetitivePricingForASIN response, (asin, 0, None, None) if there is no offers """
+
+    rows = []
+
+    for result in competitive_pricing_results(get_tree(xml)):
+        prices = competitive_prices(result)
+
+        if not len(prices):
+            rows.append((result.get('ASIN'), 0, None, None))
+            continue
+
+        # buybox price for new condition has id 1, the first price is used if there is no such price
+
+        price = prices[0]
+
+        if len(prices) > 1:
+            buybox_prices = [element for element in prices if competitive_price_id(element) == '1']
+
+            if len(buybox_prices):
+                price = buybox_prices[-1]
+
+        rows.append((
+            result.get('ASIN'), get_amount([price], landed_price, listing_price),
+            price.get('belongsToRequester') == 'true', None
+        ))
+
+    return rows
+
+
+def extract_lowest_offer_prices(xml: (str, bytes)) -> list:
+    """ Get lowest listing prices from GetLowestOfferListingsForASIN response """
+
+    rows = []
+
+    for result in lowest_offer_listings_results(get_tree(xml)):
+        listings = lowest_offer_listings(result)
+        price = get_amount(listings, landed_price, listing_price) if len(listings) else 0
+        rows.append((result.get('ASIN'), price, None, None))
+
+    return rows
+
+
+def extract_my_prices(xml: (str, bytes)) -> list:
+    """ Get my offer prices from GetMyPriceForASIN response """
+
+    rows = []
+
+    for result in my_price_results(get_tree(xml)):
+        offer = first_offer(result)
+        price = get_amount(offer, buying_landed_price, buying_listing_price) if len(offer) else 0
+        rows.append((result.get('ASIN'), price, None, None))
+
+    return rows
+
+
+def extract_ranks(xml: (str, bytes)) -> list:
+    """ Get sales ranks from GetMatchingProductForId response, 0 if item has no rank """
+
+    rows = []
+
+    for result in matching_product_results(get_tree(xml)):
+        rank = first_rank(result)
+        rows.append((result.get('Id'), None, None, int(rank) if rank.isdigit() else 0))
+
+    return rows
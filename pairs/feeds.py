@@ -0,0 +1,240 @@
+import logging
+
+from random import uniform
+from time import sleep, time
+
+from config import constants
+from utils import amazon_feeds_api
+from .parsers import get_feed_submission_from_response, get_feed_statuses_from_response
+
+logger = logging.getLogger('custom')
+
+
+class FeedTracker(object):
+    """
+    Amazon feeds completion tracker
+
+    Records ids of awaited feeds and polls them by GetFeedSubmissionList in batches,
+    with exponential backoff and jitter between polls, feeds are forgotten when done or out of time
+    """
+
+    def __init__(self,
+                 api=amazon_feeds_api,
+                 batch_size: int = constants.amazon_feed_poll_batch,
+                 min_delay: float = constants.amazon_feed_poll_min_delay,
+                 max_delay: float = constants.amazon_feed_poll_max_delay,
+                 backoff: float = constants.amazon_feed_poll_backoff,
+                 jitter: float = constants.amazon_feed_poll_jitter):
+        """
+        FeedTracker initialization
+
+        :param api: ApiObject for Amazon Feeds api
+        :param batch_size: max feed submission ids in one GetFeedSubmissionList request
+        :param min_delay: first delay between polls in seconds
+        :param max_delay: max delay between polls in seconds
+        :param backoff: delay multiplier after every poll
+        :param jitter: max random part of delay, fraction of delay
+        """
+
+        self._api = api
+        self._batch_size = batch_size
+        self._min_delay = min_delay
+        self._max_delay = max_delay
+        self._backoff = backoff
+        self._jitter = jitter
+        self._statuses = {}
+
+    def add(self, feed_ids: list) -> None:
+        """ Record submitted feeds """
+
+        for feed_id in feed_ids:
+            self._statuses[feed_id] = '_SUBMITTED_'
+
+    def forget(self, feed_ids: list) -> None:
+        """ Stop tracking given feeds """
+
+        for feed_id in feed_ids:
+            self._statuses.pop(feed_id, None)
+
+    def status(self, feed_id: str) -> (str, None):
+        """ Get last known processing status of the feed """
+
+        return self._statuses.get(feed_id)
+
+    def is_done(self, feed_id: str) -> bool:
+        return self._statuses.get(feed_id) in constants.amazon_feed_done_statuses
+
+    def poll(self, feed_ids: list = None) -> list:
+        """
+        Update statuses of given (or all tracked) feeds, one request per batch of ids
+
+        :return: list of feed ids that are not done yet
+        """
+
+        if feed_ids is None:
+            feed_ids = list(self._statuses.keys())
+
+        pending = [feed_id for feed_id in feed_ids if not self.is_done(feed_id)]
+
+        for batch in [pending[x:x + self._batch_size] for x in range(0, len(pending), self._batch_size)]:
+            try:
+                response = self._api.api.get_feed_submission_list(feedids=batch)
+
+            except self._api.connection_error as e:
+                logger.warning('Unhandled Amazon Feeds api error: {0}.'.format(e))
+                continue
+
+            self._statuses.update(get_feed_statuses_from_response(response))
+
+        return [feed_id for feed_id in pending if not self.is_done(feed_id)]
+
+    def next_delay(self, attempt: int) -> float:
+        """ Delay before the poll with given number, with exponential backoff and jitter """
+
+        delay = min(self._max_delay, self._min_delay * self._backoff ** attempt)
+        return delay + uniform(0, delay * self._jitter)
+
+    def wait(self, feed_ids: list, timeout: float = constants.amazon_feed_wait_timeout) -> bool:
+        """
+        Wait until all given feeds are done
+
+        :param feed_ids: feed submission ids
+        :param timeout: max waiting time in seconds
+        :return: True if all feeds are done, False if timeout occurred
+        """
+
+        self.add([feed_id for feed_id in feed_ids if feed_id not in self._statuses])
+        start = time()
+        attempt = 0
+
+        while True:
+            pending = self.poll(feed_ids)
+
+            if not len(pending):
+                logger.info('Feeds done: {0}, waiting time: {1:.1f} s'.format(feed_ids, time() - start))
+                self.forget(feed_ids)
+                return True
+
+            delay = self.next_delay(attempt)
+
+            if time() - start + delay > timeout:
+                logger.critical('Feeds processing is out of time, pending feeds: {0}'.format(pending))
+                self.forget(feed_ids)
+                return False
+
+            sleep(delay)
+            attempt += 1
+
+
+class FeedSubmitter(object):
+    """
+    Amazon feeds submission manager
+
+    Splits large message sets into size-bounded chunks and submits them back-to-back
+    within the shared SubmitFeed quota
+    """
+
+    def __init__(self,
+                 api=amazon_feeds_api,
+                 max_messages: int = constants.amazon_feed_max_messages,
+                 max_size: int = constants.amazon_feed_max_size,
+                 tries: int = constants.amazon_feed_chunk_tries):
+        """
+        FeedSubmitter initialization
+
+        :param api: ApiObject for Amazon Feeds api
+        :param max_messages: max messages number in one feed chunk
+        :param max_size: max feed chunk body size in bytes
+        :param tries: number of tries to submit one chunk
+        """
+
+        self._api = api
+        self._max_messages = max_messages
+        self._max_size = max_size
+        self._tries = tries
+
+    def __call__(self, helper, message_type: str, messages: list) -> tuple:
+        """
+        Submit messages in chunks
+
+        :param helper: XmlHelper for messages of given type
+        :param message_type: feed message type from constants.amazon_feed_types
+        :param messages: list of messages arguments for XmlHelper.add_message
+        :return: tuple: (list of accepted feed submission ids, list of messages of not accepted chunks)
+        """
+
+        feed_ids, failed = [], []
+
+        for chunk in self._split(helper, messages):
+            feed_id = self._submit_chunk(helper, message_type, chunk)
+
+            if feed_id is None:
+                failed.append(chunk)
+            else:
+                feed_ids.append(feed_id)
+
+        if len(failed):
+            logger.critical('Feed chunks failed: {0} of {1}, message type: {2}, messages: {3}.'.format(
+                len(failed), len(failed) + len(feed_ids), message_type, [len(chunk) for chunk in failed]
+            ))
+
+        if not len(feed_ids):
+            raise ValueError('Feeds Api did not accept any chunk of messages. Message type: {0}.'.format(message_type))
+
+        logger.info('Feed submitted in {0} chunks, message type: {1}, ids: {2}.'.format(
+            len(feed_ids), message_type, feed_ids
+        ))
+
+        return feed_ids, [message for chunk in failed for message in chunk]
+
+    def _split(self, helper, messages: list) -> list:
+        """ Split messages by max messages number, then by max feed size """
+
+        chunks = [messages[x:x + self._max_messages] for x in range(0, len(messages), self._max_messages)]
+        result = []
+
+        while len(chunks):
+            chunk = chunks.pop(0)
+            helper.make_body(chunk)
+            size = len(helper.tree)
+            helper.reload_tree()
+
+            if size > self._max_size and len(chunk) > 1:
+                middle = len(chunk) // 2
+                chunks[:0] = [chunk[:middle], chunk[middle:]]
+
+            else:
+                result.append(chunk)
+
+        return result
+
+    def _submit_chunk(self, helper, message_type: str, chunk: list) -> (str, None):
+        """ Submit one feed chunk, return feed submission id or None on failure """
+
+        for _ in range(self._tries):
+            helper.make_body(chunk)
+
+            try:
+                response = self._api.api.submit_feed(feed=helper.tree,
+                                                     feed_type=self._api.feed_types[message_type],
+                                                     marketplaceids=[self._api.region])
+
+            except self._api.connection_error as e:
+                logger.warning('Unhandled Amazon Feeds api error: {0}.'.format(e))
+                continue
+
+            finally:
+                helper.reload_tree()
+
+            feed_id, status = get_feed_submission_from_response(response)
+
+            if status == '_SUBMITTED_':
+                return feed_id
+
+            logger.warning('Feeds Api did not accept feed chunk. Status: {0}, message type: {1}.'.format(
+                status, message_type
+            ))
+
+
+feed_tracker = FeedTracker()
+submit_feed = FeedSubmitter()
@@ -7,11 +7,12 @@ from re import search
 from requests.adapters import ConnectionError
 
 from config import constants
-from utils import ebay_trading_api, amazon_products_api
-from .helpers import get_item_price_info, check_profit
+from utils import ebay_trading_api, amazon_products_api, api_priority
+from .helpers import get_item_price_info
+from .profit import profit_engine
 from .models import Pair, NotAllowedSeller
 from .parsers import (
-    get_rank_from_response, get_delivery_time, get_ebay_price_from_response, get_seller_id_from_response,
+    get_rank_from_response, get_delivery_time_async, get_ebay_price_from_response, get_seller_id_from_response,
     get_ebay_quantity_from_response
 )
 
@@ -78,8 +79,11 @@ class PairForm(forms.ModelForm):
         # validation based on api response
 
         try:
-            response = amazon_products_api.api.get_matching_product_for_id(amazon_products_api.region, 'ASIN', [asin])
-            response_my_product = amazon_products_api.api.get_my_price_for_asin(amazon_products_api.region, [asin])
+            with api_priority('high', constants.web_quota_timeout):
+                response = amazon_products_api.api.get_matching_product_for_id(amazon_products_api.region, 'ASIN',
+                                                                               [asin])
+                response_my_product = amazon_products_api.api.get_my_price_for_asin(amazon_products_api.region,
+                                                                                     [asin])
 
         except amazon_products_api.connection_error as e:
             logger.warning(e)
@@ -117,7 +121,8 @@ class PairForm(forms.ModelForm):
                                           ['LandedPrice']['Amount']['value'])
 
             except (KeyError, ValueError):
-                self.amazon_price = get_item_price_info([asin], logger)
+                with api_priority('high', constants.web_quota_timeout):
+                    self.amazon_price = get_item_price_info([asin], logger)
 
                 if self.amazon_price is None:
                     raise forms.ValidationError({'asin': 'Getting price from Amazon failed'}, code='am10')
@@ -180,8 +185,6 @@ class PairForm(forms.ModelForm):
                 'ebay_ids': 'Your input string contains more than {0} ids.'.format(constants.ebay_ids_max_count)
             }, code='eb5')
 
-        blacklist = [na_seller.ebay_user_id for na_seller in NotAllowedSeller.objects.all()]
-
         for ebay_id in ebay_ids_split:
             if len(ebay_id) != constants.ebay_id_length:
                 raise forms.ValidationError({
@@ -189,88 +192,109 @@ class PairForm(forms.ModelForm):
                     .format(constants.ebay_id_length)
                 }, code='eb6')
 
-            # validation based on api response
-
-            try:
-                response = ebay_trading_api.api.execute('GetItem', {'ItemID': ebay_id})
+        blacklist = [na_seller.ebay_user_id for na_seller in NotAllowedSeller.objects.all()]
 
-            except ConnectionError:
-                raise forms.ValidationError({
-                    'ebay_ids': 'Remote end closed connection without response from eBay. Please try again.'
-                }, code='eb17')
+        # item pages are loaded in background while items are checked by api,
+        # not started page requests are cancelled when validation fails
 
-            except ebay_trading_api.connection_error as e:
-                if e.response.dict()['Errors']['ErrorCode'] == '17':
-                    raise forms.ValidationError({'ebay_ids': 'This id ({0}) is invalid.'.format(ebay_id)}, code='eb9')
+        delivery_times = {ebay_id: get_delivery_time_async(ebay_id) for ebay_id in ebay_ids_split}
 
-                else:
-                    logger.warning(e.response.dict()['Errors'])
+        try:
+            for ebay_id in ebay_ids_split:
+                # validation based on api response
 
+                if not ebay_trading_api.acquire('GetItem', priority='high', timeout=constants.web_quota_timeout):
                     raise forms.ValidationError({
-                        'ebay_ids': 'eBay api unhandled error: {0}.'.format(e.response.dict()['Errors'])
-                    }, code='eb10')
+                        'ebay_ids': 'eBay api calls limit is reached. Please try again later.'
+                    }, code='eb19')
 
-            else:
-                # listing status checking
+                try:
+                    response = ebay_trading_api.api.execute('GetItem', {'ItemID': ebay_id})
 
-                if response.reply.Item.SellingStatus.ListingStatus != 'Active':
+                except ConnectionError:
                     raise forms.ValidationError({
-                        'ebay_ids': "Listing status for this item ({0}) is not 'Active'.".format(ebay_id)
-                    }, code='eb11')
+                        'ebay_ids': 'Remote end closed connection without response from eBay. Please try again.'
+                    }, code='eb17')
 
-                if response.reply.Item.ReturnPolicy.ReturnsAcceptedOption == 'ReturnsNotAccepted':
-                    raise forms.ValidationError({
-                        'ebay_ids': 'Seller does not accept return for this item ({0}).'.format(ebay_id)
-                    }, code='eb12')
+                except ebay_trading_api.connection_error as e:
+                    if e.response.dict()['Errors']['ErrorCode'] == '17':
+                        raise forms.ValidationError({'ebay_ids': 'This id ({0}) is invalid.'.format(ebay_id)},
+                                                    code='eb9')
 
-                # checking seller statistics
+                    else:
+                        logger.warning(e.response.dict()['Errors'])
 
-                feedback_score = int(response.reply.Item.Seller.FeedbackScore)
+                        raise forms.ValidationError({
+                            'ebay_ids': 'eBay api unhandled error: {0}.'.format(e.response.dict()['Errors'])
+                        }, code='eb10')
 
-                if feedback_score <= constants.ebay_min_feedback_score:
-                    raise forms.ValidationError({
-                        'ebay_ids': 'Feedback score for this item ({0}) lower or equal than {1}.'
-                        .format(ebay_id, constants.ebay_min_feedback_score)
-                    }, code='eb16')
+                else:
+                    # listing status checking
 
-                positive_feedback = float(response.reply.Item.Seller.PositiveFeedbackPercent)
+                    if response.reply.Item.SellingStatus.ListingStatus != 'Active':
+                        raise forms.ValidationError({
+                            'ebay_ids': "Listing status for this item ({0}) is not 'Active'.".format(ebay_id)
+                        }, code='eb11')
 
-                if positive_feedback <= constants.ebay_min_positive_percentage:
-                    raise forms.ValidationError({
-                        'ebay_ids': 'Positive feedback percentage for this item ({0}) lower or equal than {1}%.'
-                        .format(ebay_id, constants.ebay_min_positive_percentage)
-                    }, code='eb15')
+                    if response.reply.Item.ReturnPolicy.ReturnsAcceptedOption == 'ReturnsNotAccepted':
+                        raise forms.ValidationError({
+                            'ebay_ids': 'Seller does not accept return for this item ({0}).'.format(ebay_id)
+                        }, code='eb12')
 
-                # item delivery time
+                    # checking seller statistics
 
-                delivery_time = get_delivery_time(ebay_id)
+                    feedback_score = int(response.reply.Item.Seller.FeedbackScore)
 
-                if delivery_time is None:
-                    raise forms.ValidationError({'ebay_ids': 'Getting delivery time failed. Please try later.'},
-                                                code='eb14')
+                    if feedback_score <= constants.ebay_min_feedback_score:
+                        raise forms.ValidationError({
+                            'ebay_ids': 'Feedback score for this item ({0}) lower or equal than {1}.'
+                            .format(ebay_id, constants.ebay_min_feedback_score)
+                        }, code='eb16')
 
-                if delivery_time > constants.ebay_max_delivery_time:
-                    raise forms.ValidationError({
-                        'ebay_ids': 'Delivery time for this item ({0}) is greater than {1} days.'
-                        .format(ebay_id, constants.ebay_max_delivery_time)
-                    }, code='eb13')
+                    positive_feedback = float(response.reply.Item.Seller.PositiveFeedbackPercent)
 
-                # check for item seller status
+                    if positive_feedback <= constants.ebay_min_positive_percentage:
+                        raise forms.ValidationError({
+                            'ebay_ids': 'Positive feedback percentage for this item ({0}) lower or equal than {1}%.'
+                            .format(ebay_id, constants.ebay_min_positive_percentage)
+                        }, code='eb15')
 
-                seller = get_seller_id_from_response(response)
+                    # item delivery time
 
-                if seller in blacklist:
-                    raise forms.ValidationError({
-                        'ebay_ids': 'Seller of this item ({0}) is in blacklist.'.format(ebay_id)
-                    }, code='eb18')
+                    delivery_time = delivery_times[ebay_id].result()
+
+                    if delivery_time is None:
+                        raise forms.ValidationError({'ebay_ids': 'Getting delivery time failed. Please try later.'},
+                                                    code='eb14')
+
+                    if delivery_time > constants.ebay_max_delivery_time:
+                        raise forms.ValidationError({
+                            'ebay_ids': 'Delivery time for this item ({0}) is greater than {1} days.'
+                            .format(ebay_id, constants.ebay_max_delivery_time)
+                        }, code='eb13')
+
+                    # check for item seller status
+
+                    seller = get_seller_id_from_response(response)
+
+                    if seller in blacklist:
+                        raise forms.ValidationError({
+                            'ebay_ids': 'Seller of this item ({0}) is in blacklist.'.format(ebay_id)
+                        }, code='eb18')
+
+                    # getting eBay price
+
+                    self.ebay_price.append(get_ebay_price_from_response(response))
 
-                # getting eBay price
+                    # getting quantity
 
-                self.ebay_price.append(get_ebay_price_from_response(response))
+                    self.quantity += get_ebay_quantity_from_response(response)
 
-                # getting quantity
+        except forms.ValidationError:
+            for future in delivery_times.values():
+                future.cancel()
 
-                self.quantity += get_ebay_quantity_from_response(response)
+            raise
 
         # checking all eBay prices
 
@@ -298,7 +322,7 @@ class PairForm(forms.ModelForm):
             raise forms.ValidationError('You have not changed anything.', code='fe1')
 
         profit_check, self.amazon_minimum_price, self.amazon_approximate_price = \
-            check_profit(self.amazon_price, self.ebay_price)
+            profit_engine.check_profit(self.amazon_price, self.ebay_price)
 
         if not self.errors and not profit_check:
             raise forms.ValidationError('Specified items do not bring the minimum desired benefit.', code='fe2')
@@ -1,10 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import local
 from re import fullmatch
-from time import sleep
+from requests.adapters import ConnectionError
 
 from config import constants
-from utils import amazon_products_api
-from .parsers import get_buybox_price_from_response, get_no_buybox_price_from_response, get_my_price_from_response
+from utils import amazon_products_api, ebay_trading_api, api_priority, get_api_priority
+from .parsers import get_my_price_from_response, get_ebay_price_from_response
+from .extractors import extract_competitive_prices, extract_lowest_offer_prices
 from .models import Pair, CustomUser
+from .cache import price_info_cache
 
 
 def pairs_search(search_term, user):
@@ -42,70 +46,129 @@ def pairs_search(search_term, user):
     return queryset
 
 
-def get_item_price_info(asins, logger, delay=0.5):
+def get_part_price_info(part, logger):
     """
-    Create items price info list in format:
+    Create price info list for one part of ASINs (up to 20 items) in format:
         list element: [asin, lowest price, is_buybox_winner]
+
+    Returns None if the part request failed
     """
 
-    result_price_info = []
+    logger.info('Asins part: {}'.format(part))
 
-    asins = [asins[x:x + constants.amazon_get_my_price_items_limit] for x in range(
-        0, len(asins), constants.amazon_get_my_price_items_limit
-    )]
+    # get buybox-existence info
 
-    logger.info('Getting price info started')
+    try:
+        response = amazon_products_api.api.get_competitive_pricing_for_asin(amazon_products_api.region, part)
 
-    for part in asins:
-        logger.info('Asins part: {}'.format(part))
+    except amazon_products_api.connection_error:
+        logger.critical('Getting BB prices failed for part: {0}'.format(part))
+        return
 
-        # get buybox-existence info
+    # save info from response to price_info list
 
-        price_info = [[asin] for asin in part]
+    price_info = [[asin, price, is_buybox_winner] for asin, price, is_buybox_winner, _ in
+                  extract_competitive_prices(response.original)]
 
-        try:
-            response = amazon_products_api.api.get_competitive_pricing_for_asin(amazon_products_api.region, part)
+    # get price info for no-buybox items
 
-        except amazon_products_api.connection_error:
-            logger.critical('Getting BB prices failed for part: {0}'.format(part))
-            return
+    asins_no_buybox = [asin_info[0] for asin_info in price_info if asin_info[2] is None]
 
-        # save info from response to price_info list
+    if not len(asins_no_buybox):
+        return price_info
 
-        get_buybox_price_from_response(price_info, response)
+    try:
+        response = amazon_products_api.api.get_lowest_offer_listings_for_asin(
+            amazon_products_api.region, asins_no_buybox, condition='New'
+        )
 
-        # get price info for no-buybox items
+    except amazon_products_api.connection_error:
+        logger.critical('Getting listing prices failed for part: {0}'.format(part))
+        return
 
-        asins_no_buybox = [asin_info[0] for asin_info in price_info if asin_info[2] is None]
+    # set lowest listing prices in price_info list
 
-        if not len(asins_no_buybox):
-            result_price_info += price_info
-            continue
+    no_buybox_prices = {asin: price for asin, price, _, _ in extract_lowest_offer_prices(response.original)}
 
-        try:
-            response = amazon_products_api.api.get_lowest_offer_listings_for_asin(
-                amazon_products_api.region, asins_no_buybox, condition='New'
-            )
+    for asin_info in price_info:
+        if asin_info[0] in no_buybox_prices:
+            asin_info[1] = no_buybox_prices[asin_info[0]]
+
+    return price_info
+
+
+def iter_item_price_info(asins, logger, workers=constants.amazon_price_workers, cache=price_info_cache):
+    """
+    Generator of items price info lists, list element format:
+        [asin, lowest price, is_buybox_winner]
+
+    Cached ASINs are yielded first, others are requested concurrently in parts within the shared
+    Products api quota and yielded as they arrive. ASINs already requested by other callers
+    are yielded after their requests finish. Requests use the api priority of the calling thread
+    """
+
+    priority = get_api_priority()
+
+    def get_part(part):
+        with api_priority(*priority):
+            return get_part_price_info(part, logger)
+
+    if cache is None:
+        cached, own, in_flight = [], list(asins), []
+    else:
+        cached, own, in_flight = cache.lookup(asins)
+
+    logger.info('Getting price info started, cached: {0}, in flight: {1}'.format(len(cached), len(in_flight)))
+
+    if len(cached):
+        yield cached
+
+    parts = [own[x:x + constants.amazon_get_my_price_items_limit] for x in range(
+        0, len(own), constants.amazon_get_my_price_items_limit
+    )]
 
-        except amazon_products_api.connection_error:
-            result_price_info += price_info
-            logger.critical('Getting listing prices failed for part: {0}'.format(part))
-            return
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in as_completed([executor.submit(get_part, part) for part in parts]):
+                price_info = future.result()
 
-        # save info from response to asins_no_buybox list
+                if price_info is None:
+                    continue
 
-        get_no_buybox_price_from_response(asins_no_buybox, response)
+                if cache is not None:
+                    cache.set_many(price_info)
 
-        # set new prices in price_info list
+                yield price_info
 
-        for asin_info in asins_no_buybox:
-            for price_info_elem in price_info:
-                if asin_info[0] == price_info_elem[0]:
-                    price_info_elem[1] = asin_info[1]
-                    break
+    finally:
+        if cache is not None:
+            cache.release(own)
 
+    if len(in_flight):
+        price_info = cache.wait(in_flight)
+
+        if len(price_info):
+            yield price_info
+
+    if cache is not None:
+        logger.info('Price info cache stats: {0}'.format(cache.stats()))
+
+
+def get_item_price_info(asins, logger, cache=price_info_cache):
+    """
+    Create items price info list in format:
+        list element: [asin, lowest price, is_buybox_winner]
+
+    Returns None if price info was not received for any of the ASINs, cache is None for fresh prices only
+    """
+
+    result_price_info = []
+
+    for price_info in iter_item_price_info(asins, logger, cache=cache):
         result_price_info += price_info
-        sleep(delay)
+
+    if len(asins) and not len(result_price_info):
+        return
 
     return result_price_info
 
@@ -125,48 +188,26 @@ def update_my_prices():
         pair.save(update_fields=['amazon_current_price'])
 
 
-def check_profit(amazon_price: float, ebay_prices: list) -> tuple:
+def get_ebay_prices(ebay_ids, logger, workers=constants.ebay_price_workers, priority='low'):
     """
-    Check minimum profit for asin and all eBay ids and calculate approximate price for Amazon
-
-    :param amazon_price: Amazon item lowest price
-    :param ebay_prices: list of eBay items prices
-    :return: tuple: check result and calculated prices in format:
-        (Check result - True or False, Amazon minimum price, Amazon approximate price)
+    Get eBay items prices concurrently, every thread uses its own Trading api connection,
+    returns dictionary in format: {ebay_id: price or None if request failed}
     """
 
-    prices, chosen_ebay_prices = [], []
-
-    for ebay_price in ebay_prices:
-        if not ebay_price:
-            continue
-
-        price = 0
-
-        for interval in constants.profit_intervals:
-            if interval[0] <= ebay_price < interval[1]:
-                price = ebay_price * constants.profit_intervals[interval] / constants.profit_percentage
-                prices.append(price)
-                chosen_ebay_prices.append(ebay_price)
-                break
+    connections = local()
 
-        if amazon_price:
-            if price + constants.profit_buffer >= amazon_price:
-                return False, None, None
+    def get_price(ebay_id):
+        if getattr(connections, 'api', None) is None:
+            connections.api = ebay_trading_api.connect()
 
-    # getting approximate price
+        ebay_trading_api.acquire('GetItem', priority=priority)
 
-    if not len(prices):
-        return False, None, None
-
-    max_ebay_price_coeff = 0
-    max_price = max(prices)
-    max_ebay_price = chosen_ebay_prices[prices.index(max_price)]
+        try:
+            return ebay_id, get_ebay_price_from_response(connections.api.execute('GetItem', {'ItemID': ebay_id}))
 
-    for interval in constants.amazon_approximate_price_percent:
-        if interval[0] <= max_ebay_price < interval[1]:
-            max_ebay_price_coeff = constants.amazon_approximate_price_percent[interval]
+        except (ebay_trading_api.connection_error, ConnectionError) as e:
+            logger.warning('eBay ID: {0}, eBay api unhandled error: {1}.'.format(ebay_id, e))
+            return ebay_id, None
 
-    amazon_minimum_price = round(min(prices), 2)
-    amazon_approximate_price = round(max_price + max_ebay_price * max_ebay_price_coeff, 2)
-    return True, amazon_minimum_price, amazon_approximate_price
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(executor.map(get_price, ebay_ids))
@@ -0,0 +1,94 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from time import perf_counter
+
+from config import constants
+from pairs.helpers import get_ebay_prices
+from pairs.models import Pair
+from pairs.profit import profit_engine
+
+logger = logging.getLogger('custom')
+
+
+class Command(BaseCommand):
+    help = 'Populate empty approximate or minimum Amazon prices by eBay prices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min', action='store_true', dest='for_min_price',
+                            help='Populate minimum prices instead of approximate prices')
+        parser.add_argument('--batch-size', type=int, default=constants.app_prices_batch_size,
+                            help='Pairs number per batch')
+        parser.add_argument('--workers', type=int, default=constants.ebay_price_workers,
+                            help='Concurrent eBay requests number')
+        parser.add_argument('--start-id', type=int, default=0,
+                            help='Resume from the pair with id greater than given one')
+
+    def handle(self, *args, for_min_price=False, batch_size=constants.app_prices_batch_size,
+               workers=constants.ebay_price_workers, start_id=0, **options):
+        field = 'amazon_minimum_price' if for_min_price else 'amazon_approximate_price'
+        pairs = Pair.objects.filter(**{field: 0}).order_by('id').only('id', 'asin', 'ebay_ids', field)
+        total = pairs.filter(id__gt=start_id).count()
+        processed, updated, items, failed, retried, last_id, start = 0, 0, 0, [], [], start_id, perf_counter()
+
+        self.stdout.write('Pairs with empty {0}: {1}'.format(field, total))
+
+        while True:
+            batch = list(pairs.filter(id__gt=last_id)[:batch_size])
+
+            if not len(batch):
+                break
+
+            ebay_ids = [pair.ebay_ids.split(';') for pair in batch]
+            ebay_prices = get_ebay_prices([ebay_id for ids in ebay_ids for ebay_id in ids], logger, workers)
+
+            # pairs with failed eBay requests stay empty and are retried by the next command run
+
+            ready = []
+
+            for pair, ids in zip(batch, ebay_ids):
+                if any(ebay_prices[ebay_id] is None for ebay_id in ids):
+                    retried.append(pair.asin)
+
+                else:
+                    ready.append((pair, ids))
+
+            # eBay prices matrix, missing ids are zeros
+
+            minimum_prices, approximate_prices, calculated, _ = profit_engine.calc_prices([
+                [ebay_prices[ebay_id] for ebay_id in ids] + [0] * (constants.ebay_ids_max_count - len(ids))
+                for _, ids in ready
+            ]) if len(ready) else ([], [], [], None)
+
+            prices = minimum_prices if for_min_price else approximate_prices
+            changed = []
+
+            for index, (pair, _) in enumerate(ready):
+                if calculated[index]:
+                    setattr(pair, field, float(prices[index]))
+                    changed.append(pair)
+
+                else:
+                    failed.append(pair.asin)
+
+            Pair.objects.bulk_update(changed, [field], batch_size=constants.bulk_batch_size)
+
+            processed += len(batch)
+            updated += len(changed)
+            items += len(ebay_prices)
+            last_id = batch[-1].id
+            duration = perf_counter() - start
+
+            self.stdout.write('Processed: {0}/{1}, updated: {2}, last id: {3}, {4:.1f} pairs/s, {5:.1f} eBay items/s'
+                              .format(processed, total, updated, last_id, processed / duration, items / duration))
+
+        if len(failed):
+            self.stdout.write('Prices are not calculated for ASINs: {0}'.format(', '.join(failed)))
+
+        if len(retried):
+            self.stdout.write('eBay requests failed, run the command again for ASINs: {0}'.format(', '.join(retried)))
+
+        self.stdout.write(self.style.SUCCESS('Done, updated: {0} of {1}, time: {2:.1f} s'.format(
+            updated, total, perf_counter() - start
+        )))
@@ -1,4 +1,5 @@
 import logging
+from time import time
 from django.db import models
 from django.contrib.postgres.fields import JSONField
 from requests.adapters import ConnectionError
@@ -25,6 +26,13 @@ class OrdersManager(models.Manager):
         return orders.exclude(id__in=unnecessary_orders_ids)
 
 
+class PairsManager(models.Manager):
+    def in_bulk_asins(self, asins):
+        """ Resolve pairs by ASINs with a single query, return dictionary in format: asin: pair """
+
+        return {pair.asin: pair for pair in self.filter(asin__in=list(asins))}
+
+
 class TimeStamped(models.Model):
     """ An abstract base class model that provides self updating """
 
@@ -84,6 +92,7 @@ class Pair(TimeStamped):
     is_buybox_winner = models.BooleanField(default=False)
     old_buybox_price = models.FloatField(default=0)
     reason_message = models.CharField(max_length=constants.reason_message_max_length, blank=True)
+    objects = PairsManager()
 
     class Meta:
         db_table = 'pairs'
@@ -103,22 +112,22 @@ class Pair(TimeStamped):
         quantity = 0
 
         for ebay_id in str(self.ebay_ids).split(';'):
-            if not ebay_trading_api.check_calls(False, print, 'eBay api calls number is over.'):
-                break
+            if not ebay_trading_api.acquire('GetItem', block=False):
+                logger.warning('eBay api GetItem calls number is over.')
+                return
 
-            else:
-                try:
-                    response = ebay_trading_api.api.execute('GetItem', {'ItemID': ebay_id})
+            try:
+                response = ebay_trading_api.api.execute('GetItem', {'ItemID': ebay_id})
 
-                except ebay_trading_api.connection_error as e:
-                    logger.critical('eBay ID: {0}, eBay api unhandled error: {1}.'.format(ebay_id, e.response.dict()))
-                    return
+            except ebay_trading_api.connection_error as e:
+                logger.critical('eBay ID: {0}, eBay api unhandled error: {1}.'.format(ebay_id, e.response.dict()))
+                return
 
-                except ConnectionError:
-                    logger.critical('Remote end closed connection without response from eBay.')
-                    return
+            except ConnectionError:
+                logger.critical('Remote end closed connection without response from eBay.')
+                return
 
-                quantity += get_ebay_quantity_from_response(response)
+            quantity += get_ebay_quantity_from_response(response)
 
         self.quantity = quantity
 
@@ -244,3 +253,100 @@ class NotAllowedSeller(models.Model):
 
     def __str__(self):
         return self.ebay_user_id
+
+
+class WorkflowRun(TimeStamped):
+    """
+    Amazon workflow run state, workflow tasks are chained through it
+
+    :field step: current (not completed yet) workflow step, one of WorkflowRun.steps
+    :field pair_ids: ids of pairs selected for uploading
+    :field asins: uploaded ASINs for getting and setting prices
+    :field feed_ids: feed submission ids the current step waits for
+    :field reconciled: is upload results checked by feed processing reports
+    :field delay: sleep period in seconds for SubmitFeed failure retries
+    :field tries: number of tries in SubmitFeed failure case
+    :field feed_tries: number of failed SubmitFeed tries in the current step
+    :field poll_attempt: number of feeds status polls in the current step
+    :field feeds_submitted: time when the current step feeds were submitted
+    :field finished: run finish time
+    :field updated: last state change time, used for finding stale runs to resume
+    :field chain: number of the task chain that executes the run, increases on every resume
+
+    :field steps_times: dictionary with steps start and completion timestamps in format:
+        step: [start, end]
+    """
+
+    steps = 'check_before', 'upload', 'reconcile', 'quantity', 'prices', 'check_after', 'done'
+
+    step = models.CharField(max_length=constants.workflow_step_length, default=steps[0])
+    pair_ids = JSONField(default=list)
+    asins = JSONField(default=list)
+    feed_ids = JSONField(default=list)
+    reconciled = models.BooleanField(default=False)
+    delay = models.PositiveIntegerField(default=constants.amazon_workflow_delay)
+    tries = models.PositiveSmallIntegerField(default=3)
+    feed_tries = models.PositiveSmallIntegerField(default=0)
+    poll_attempt = models.PositiveSmallIntegerField(default=0)
+    feeds_submitted = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+    chain = models.PositiveIntegerField(default=0)
+    steps_times = JSONField(default=dict)
+
+    class Meta:
+        db_table = 'workflowruns'
+
+    def __str__(self):
+        return 'Workflow run {0}, step: {1}'.format(self.id, self.step)
+
+    def save_state(self, *fields):
+        """ Save given fields and update the state change time """
+
+        self.save(update_fields=list(fields) + ['updated'])
+
+    def start_step(self):
+        """ Set start time of the current step, if it is not started yet """
+
+        if self.step not in self.steps_times:
+            self.steps_times[self.step] = [time(), None]
+
+    def complete_steps(self):
+        """ Set completion time for all started steps """
+
+        for times in self.steps_times.values():
+            if times[1] is None:
+                times[1] = time()
+
+    def get_step_duration(self, step):
+        """ Get step duration in seconds or None if it is not completed """
+
+        try:
+            start, end = self.steps_times[step]
+
+        except KeyError:
+            return
+
+        if end is not None:
+            return round(end - start, 1)
+
+
+class SyncCursor(models.Model):
+    """
+    High-water mark of incremental data sync with external api
+
+    :field name: synced data name, like 'orders'
+    :field position: time of the last synced change, next sync requests changes after it
+    :field updated: last sync time
+    """
+
+    name = models.CharField(max_length=constants.sync_cursor_name_length, unique=True)
+    position = models.DateTimeField()
+    updated = models.DateTimeField(auto_now=True)
+    objects = models.Manager()
+
+    class Meta:
+        db_table = 'synccursors'
+
+    def __str__(self):
+        return '{0}: {1}'.format(self.name, self.position)
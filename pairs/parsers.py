@@ -1,11 +1,15 @@
 import logging
 
 from django.utils.timezone import get_current_timezone
-from requests import get, exceptions
+from requests import Session, exceptions
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from lxml import etree
 
+from concurrent.futures import ThreadPoolExecutor, Future
 from re import search
 from datetime import datetime
+from io import BytesIO
 
 from config import constants
 
@@ -14,11 +18,30 @@ parser = etree.HTMLParser()
 current_timezone = get_current_timezone()
 
 
+def create_session() -> Session:
+    """ Create http session with keep-alive connections pool and retries with backoff for idempotent requests """
+
+    retry = Retry(total=constants.requests_retries, backoff_factor=constants.requests_backoff,
+                  status_forcelist=constants.requests_retry_statuses, method_whitelist=frozenset(['GET', 'HEAD']))
+
+    adapter = HTTPAdapter(pool_connections=constants.requests_pool_size, pool_maxsize=constants.requests_pool_size,
+                          max_retries=retry)
+
+    new_session = Session()
+    new_session.mount('http://', adapter)
+    new_session.mount('https://', adapter)
+    return new_session
+
+
+session = create_session()
+requests_executor = ThreadPoolExecutor(max_workers=constants.requests_workers)
+
+
 def request(uri: str, headers: dict = None) -> str:
-    """ Make GET request to given uri """
+    """ Make GET request to given uri using shared session """
 
     try:
-        return get(uri, headers=headers, timeout=constants.requests_timeout).text
+        return session.get(uri, headers=headers, timeout=constants.requests_timeout).text
 
     except exceptions.Timeout:
         logger.critical('Parsers request: timeout occurred, uri: {}'.format(uri))
@@ -29,6 +52,21 @@ def request(uri: str, headers: dict = None) -> str:
     except exceptions.ConnectionError as e:
         logger.critical('Parsers request: connection error: {0}, uri: {1}'.format(e, uri))
 
+    except exceptions.RetryError as e:
+        logger.critical('Parsers request: retries are over: {0}, uri: {1}'.format(e, uri))
+
+
+def request_async(uri: str, headers: dict = None) -> Future:
+    """ Make GET request to given uri in background, returns future of response text """
+
+    return requests_executor.submit(request, uri, headers)
+
+
+def request_many(uris: list, headers: dict = None) -> list:
+    """ Make GET requests to given uris concurrently, returns responses texts in uris order """
+
+    return [future.result() for future in [request_async(uri, headers) for uri in uris]]
+
 
 # Amazon MWS response parsers
 
@@ -379,13 +417,65 @@ def get_no_buybox_price_from_response(asins_no_buybox, response):
                 asins_no_buybox[i] = asins_no_buybox[i], min(prices)
 
 
+def get_feed_submission_from_response(response):
+    """ Get feed submission id and processing status from SubmitFeed response """
+
+    info = response.parsed['FeedSubmissionInfo']
+    return info['FeedSubmissionId']['value'], info['FeedProcessingStatus']['value']
+
+
+def get_feed_statuses_from_response(response):
+    """
+    Get feeds processing statuses from GetFeedSubmissionList response in format:
+        {feed submission id: processing status}
+    """
+
+    try:
+        info = response.parsed['FeedSubmissionInfo']
+
+    except KeyError:
+        return {}
+
+    try:
+        info[0]
+
+    except KeyError:
+        info = [info]
+
+    return {feed['FeedSubmissionId']['value']: feed['FeedProcessingStatus']['value'] for feed in info}
+
+
+def get_failed_skus_from_report(report: (str, bytes)) -> set:
+    """ Stream-parse GetFeedSubmissionResult processing report and get SKUs of messages with errors """
+
+    if isinstance(report, str):
+        report = report.encode(constants.load_encoding)
+
+    skus = set()
+
+    for _, result in etree.iterparse(BytesIO(report), events=('end',), tag='{*}Result'):
+        if result.findtext('{*}ResultCode') == 'Error':
+            sku = result.findtext('{*}AdditionalInfo/{*}SKU')
+
+            if sku:
+                skus.add(sku)
+            else:
+                logger.warning('Feed processing error without SKU, message id: {0}, description: {1}'.format(
+                    result.findtext('{*}MessageID'), result.findtext('{*}ResultDescription')
+                ))
+
+        result.clear()
+
+    return skus
+
+
 # Custom response parsers
 
 
 def get_amazon_upc(asin: str) -> (list, None):
     """ Get item UPC from Amazon item page """
 
-    response = request('https://www.amazon.com/dp/{}'.format(asin), headers={'Connection': 'close'})
+    response = request('https://www.amazon.com/dp/{}'.format(asin))
 
     if response is None:
         return
@@ -414,6 +504,12 @@ def get_delivery_time(ebay_id: str) -> (int, None):
     return parse_delivery_time_response(etree.fromstring(response, parser))
 
 
+def get_delivery_time_async(ebay_id: str) -> Future:
+    """ Get delivery time from eBay item page in background, returns future of get_delivery_time result """
+
+    return requests_executor.submit(get_delivery_time, ebay_id)
+
+
 def parse_delivery_time_response(tree: etree) -> (int, None):
     """ Find and parse date string in html response """
 
@@ -0,0 +1,160 @@
+import numpy as np
+
+from config import constants
+
+
+class ProfitEngine(object):
+    """
+    Amazon prices calculator by eBay prices
+
+    Interval tables from constants are compiled into sorted boundary arrays, prices for whole
+    arrays of pairs are calculated at once. eBay prices of pairs are given as 2-D array
+    (pairs x eBay ids), zero prices are skipped, so rows with less eBay ids are padded by zeros.
+    Results are equal to the per-price calculation with Python round.
+    """
+
+    def __init__(self,
+                 profit_intervals: dict = constants.profit_intervals,
+                 approximate_price_percent: dict = constants.amazon_approximate_price_percent,
+                 profit_percentage: float = constants.profit_percentage,
+                 profit_buffer: float = constants.profit_buffer):
+        """
+        ProfitEngine initialization
+
+        :param profit_intervals: dictionary with eBay price intervals coefficients in format: (low, high): coeff
+        :param approximate_price_percent: dictionary with eBay price intervals percents for approximate price
+        :param profit_percentage: share of Amazon price left after Amazon fees
+        :param profit_buffer: minimum difference between Amazon price and calculated price
+        """
+
+        self._profit_table = self.compile(profit_intervals)
+        self._approximate_table = self.compile(approximate_price_percent)
+        self._profit_percentage = profit_percentage
+        self._profit_buffer = profit_buffer
+
+    @staticmethod
+    def compile(intervals: dict) -> tuple:
+        """ Compile intervals dictionary into sorted arrays: (low bounds, high bounds, values) """
+
+        items = sorted(intervals.items())
+
+        return (np.array([interval[0] for interval, _ in items], dtype=float),
+                np.array([interval[1] for interval, _ in items], dtype=float),
+                np.array([value for _, value in items], dtype=float))
+
+    @staticmethod
+    def lookup(table: tuple, prices: np.ndarray) -> tuple:
+        """ Get interval values for prices (low <= price < high), return (values, is interval found) """
+
+        lows, highs, values = table
+        index = np.searchsorted(lows, prices, side='right') - 1
+        clipped = np.clip(index, 0, len(lows) - 1)
+        found = (index >= 0) & (prices < highs[clipped])
+        return np.where(found, values[clipped], 0), found
+
+    @staticmethod
+    def round(values: np.ndarray, digits: int = 2) -> np.ndarray:
+        """ Round like Python round: NumPy result is recalculated for values close to a tie """
+
+        values = np.asarray(values, dtype=float)
+        rounded = np.round(values, digits)
+        scaled = np.abs(values) * 10 ** digits
+        ties = np.nonzero(np.abs(scaled - np.floor(scaled) - 0.5) < constants.round_tie_tolerance)
+
+        for index in zip(*ties):
+            rounded[index] = round(float(values[index]), digits)
+
+        return rounded
+
+    def calc_prices(self, ebay_prices) -> tuple:
+        """
+        Calculate Amazon prices for pairs
+
+        :param ebay_prices: 2-D array of pairs eBay prices
+        :return: tuple of arrays: (minimum prices, approximate prices, calculation mask,
+            not rounded prices for every eBay price, 0 if eBay price is out of intervals)
+        """
+
+        ebay_prices = np.atleast_2d(np.asarray(ebay_prices, dtype=float))
+        coeffs, found = self.lookup(self._profit_table, ebay_prices)
+        found &= ebay_prices != 0
+
+        prices = np.where(found, ebay_prices * coeffs / self._profit_percentage, 0)
+        calculated = found.any(axis=1)
+
+        # approximate price is based on the eBay price with the max calculated price (the first one)
+
+        rows = np.arange(len(ebay_prices))
+        max_index = np.where(found, prices, -np.inf).argmax(axis=1)
+        max_prices = prices[rows, max_index]
+        max_ebay_prices = ebay_prices[rows, max_index]
+        approximate_coeffs, _ = self.lookup(self._approximate_table, max_ebay_prices)
+
+        minimum_prices = np.where(calculated, np.where(found, prices, np.inf).min(axis=1), 0)
+        approximate_prices = np.where(calculated, max_prices + max_ebay_prices * approximate_coeffs, 0)
+
+        return self.round(minimum_prices), self.round(approximate_prices), calculated, prices
+
+    def check_profits(self, amazon_prices, ebay_prices) -> tuple:
+        """
+        Check minimum profit for pairs and calculate Amazon prices
+
+        :param amazon_prices: 1-D array of Amazon items lowest prices, 0 if unknown
+        :param ebay_prices: 2-D array of pairs eBay prices
+        :return: tuple of arrays: (check results, minimum prices, approximate prices)
+        """
+
+        amazon_prices = np.asarray(amazon_prices, dtype=float)
+        ebay_prices = np.atleast_2d(np.asarray(ebay_prices, dtype=float))
+        minimum_prices, approximate_prices, calculated, prices = self.calc_prices(ebay_prices)
+
+        # every not zero eBay price must leave a profit buffer under known Amazon price
+
+        low_profit = (ebay_prices != 0) & (prices + self._profit_buffer >= amazon_prices[:, np.newaxis])
+        checked = calculated & ~((amazon_prices != 0) & low_profit.any(axis=1))
+        return checked, minimum_prices, approximate_prices
+
+    def check_profit(self, amazon_price: float, ebay_prices: list) -> tuple:
+        """ Check one pair, return tuple: (check result, Amazon minimum price, Amazon approximate price) """
+
+        if not len(ebay_prices):
+            return False, None, None
+
+        checked, minimum_prices, approximate_prices = self.check_profits(
+            [amazon_price or 0], [[ebay_price or 0 for ebay_price in ebay_prices]]
+        )
+
+        if not checked[0]:
+            return False, None, None
+
+        return True, float(minimum_prices[0]), float(approximate_prices[0])
+
+    @staticmethod
+    def guard_prices(prices, minimum_prices, approximate_prices) -> tuple:
+        """
+        Apply repricer guard-rails: unknown prices are replaced by approximate prices,
+        prices lower or equal to minimum prices are raised to minimum prices
+
+        :return: tuple of arrays: (guarded prices, is minimum price granted)
+        """
+
+        prices = np.asarray(prices, dtype=float)
+        minimum_prices = np.asarray(minimum_prices, dtype=float)
+        minimum_granted = (prices != 0) & (prices <= minimum_prices)
+        prices = np.where(prices == 0, approximate_prices, np.where(minimum_granted, minimum_prices, prices))
+        return prices, minimum_granted
+
+    @staticmethod
+    def guard_price(price: float, minimum_price: float, approximate_price: float) -> tuple:
+        """ Apply repricer guard-rails to one price, return tuple: (guarded price, is minimum price granted) """
+
+        if not price:
+            return approximate_price, False
+
+        if price <= minimum_price:
+            return minimum_price, True
+
+        return price, False
+
+
+profit_engine = ProfitEngine()
@@ -1,18 +1,23 @@
-from django.utils.timezone import get_current_timezone
+from django.utils.timezone import get_current_timezone, utc
+from django.db import transaction
+from django.db.models import F, Exists, OuterRef
+from django.db.models.functions import Greatest
 from celery import shared_task
 from celery.utils.log import get_task_logger
 
+from collections import Counter
 from datetime import datetime, timedelta
 from time import sleep
 from uuid import uuid4
 
 from config import constants
-from .models import Pair, Order, shipping_info_fields
+from .models import Pair, Order, CustomUser, WorkflowRun, SyncCursor, shipping_info_fields
 from .helpers import get_item_price_info
-from .parsers import get_ebay_price_from_response
+from .parsers import get_failed_skus_from_report
+from .feeds import submit_feed, feed_tracker
 
 from utils import (
-    ebay_trading_api,                                                                     # eBay apis
+    delete_in_chunks,                                                                     # db helpers
     amazon_products_api, amazon_orders_api, amazon_feeds_api,                             # Amazon apis
     xml_quantity_helper, xml_product_helper, xml_price_helper, xml_delete_product_helper  # xml helpers
 )
@@ -20,18 +25,29 @@ from utils import (
 logger = get_task_logger(__name__)
 
 
-def gen_sku(length=10):
-    """ Generate unique seller sku string in format XX-XXXX-XXXX... """
+def gen_skus(number, length=10):
+    """
+    Generate list of unique seller sku strings in format XX-XXXX-XXXX...,
+    every generation round checks all new SKUs against db with one query and regenerates only collisions
+    """
 
     if length < 10:
         raise ValueError('SKU length must be greater than 9')
 
-    while True:
-        sku = uuid4().hex[:length].upper()
-        sku = sku[:2] + '-' + sku[2:6] + '-' + sku[6:]
+    skus = set()
+
+    while len(skus) < number:
+        new_skus = set()
 
-        if not Pair.objects.filter(seller_sku=sku).exists():
-            return sku
+        while len(new_skus) < number - len(skus):
+            sku = uuid4().hex[:length].upper()
+            new_skus.add(sku[:2] + '-' + sku[2:6] + '-' + sku[6:])
+
+        new_skus -= skus
+        new_skus -= set(Pair.objects.filter(seller_sku__in=list(new_skus)).values_list('seller_sku', flat=True))
+        skus |= new_skus
+
+    return list(skus)
 
 
 def check_products(check_type, asins=None, max_asins=constants.amazon_get_my_price_items_limit,
@@ -123,49 +139,88 @@ def check_products(check_type, asins=None, max_asins=constants.amazon_get_my_pri
         logger.info('Checking for upload results complete')
 
 
-def upload_new_pairs():
+def upload_new_pairs(pair_ids=None):
     """
     Generate seller_sku for all pairs with this blank field
     and upload them to Amazon
+
+    :param pair_ids: upload only not checked yet pairs with given ids, already generated SKUs are reused
     """
 
-    messages = []
+    if pair_ids is None:
+        pairs = Pair.objects.filter(seller_sku='').filter(checked=1)
+    else:
+        pairs = Pair.objects.filter(pk__in=pair_ids).filter(checked=1)
 
-    # gather all pairs with blank seller_sku
+    # gather pairs and generate blank seller_sku
 
-    for pair in Pair.objects.filter(seller_sku='').filter(checked=1):
-        pair.seller_sku = gen_sku()
-        pair.save(update_fields=['seller_sku'])
-        messages.append((pair.seller_sku, pair.asin))
+    pairs = list(pairs)
+    pairs_without_sku = [pair for pair in pairs if not len(pair.seller_sku)]
 
-    if len(messages):
-        xml_product_helper.make_body(messages)
-    else:
+    for pair, sku in zip(pairs_without_sku, gen_skus(len(pairs_without_sku))):
+        pair.seller_sku = sku
+
+    Pair.objects.bulk_update(pairs_without_sku, ['seller_sku'], batch_size=constants.bulk_batch_size)
+    messages = [(pair.seller_sku, pair.asin) for pair in pairs]
+
+    if not len(messages):
         logger.warning('No messages to upload products in Amazon.')
-        return []
+        return [], []
 
     # upload products to Amazon inventory
 
-    try:
-        response = amazon_feeds_api.api.submit_feed(feed=xml_product_helper.tree,
-                                                    feed_type=amazon_feeds_api.feed_types['product'],
-                                                    marketplaceids=[amazon_feeds_api.region])
+    feed_ids, failed = submit_feed(xml_product_helper, 'product', messages)
 
-    except amazon_feeds_api.connection_error as e:
-        xml_product_helper.reload_tree()
-        raise ValueError('Unhandled Amazon Feeds api error: {0}.'.format(e))
+    # pairs of not accepted chunks get blank seller_sku back and are uploaded next time
 
-    xml_product_helper.reload_tree()
-
-    if response.parsed['FeedSubmissionInfo']['FeedProcessingStatus']['value'] != '_SUBMITTED_':
-        raise ValueError('Feeds Api did not accept messages to upload products. Status: {0}. Messages: {1}.'
-                         .format(response.parsed['FeedSubmissionInfo']['FeedProcessingStatus']['value'], messages))
+    if len(failed):
+        failed_skus = {sku for sku, _ in failed}
+        Pair.objects.filter(seller_sku__in=failed_skus).update(seller_sku='')
+        messages = [message for message in messages if message[0] not in failed_skus]
+        logger.warning('Products are not uploaded and will be uploaded next time: {0}.'.format(len(failed)))
 
     logger.info('Products upload complete.')
 
     # asins for checking results
 
-    return [message[1] for message in messages]
+    return [message[1] for message in messages], feed_ids
+
+
+def reconcile_feed_results(feed_ids):
+    """
+    Download processing reports of done product feeds and mark pairs with failed SKUs
+    as unsuitable (checked=4) in bulk
+
+    :return: set of failed ASINs or None if any report is unavailable
+    """
+
+    failed_skus = set()
+
+    for feed_id in feed_ids:
+        try:
+            response = amazon_feeds_api.api.get_feed_submission_result(feed_id)
+
+        except amazon_feeds_api.connection_error as e:
+            logger.critical('Getting feed processing report failed, feed id: {0}, error: {1}.'.format(feed_id, e))
+            return
+
+        failed_skus |= get_failed_skus_from_report(response.original)
+
+    if not len(failed_skus):
+        logger.info('Upload results reconciled, no failed products')
+        return set()
+
+    pairs = Pair.objects.filter(seller_sku__in=failed_skus)
+    failed = list(pairs.values_list('asin', 'owner_id'))
+
+    with transaction.atomic():
+        pairs.update(seller_sku='', checked=4)
+
+        for owner_id, count in Counter(owner_id for _, owner_id in failed).items():
+            CustomUser.objects.filter(id=owner_id).update(pairs_count=Greatest(F('pairs_count') - count, 0))
+
+    logger.info('Upload results reconciled, failed products: {0}'.format(len(failed)))
+    return set(asin for asin, _ in failed)
 
 
 def update_pairs_quantity():
@@ -190,436 +245,537 @@ def update_pairs_quantity():
 
             messages.append((pair.seller_sku, quantity))
 
-    if len(messages):
-        xml_quantity_helper.make_body(messages)
-    else:
+    if not len(messages):
         logger.warning('No messages to update quantity in Amazon.')
-        return
+        return []
 
     # update quantities in Amazon inventory
 
-    try:
-        response = amazon_feeds_api.api.submit_feed(feed=xml_quantity_helper.tree,
-                                                    feed_type=amazon_feeds_api.feed_types['quantity'],
-                                                    marketplaceids=[amazon_feeds_api.region])
-
-    except amazon_feeds_api.connection_error as e:
-        xml_quantity_helper.reload_tree()
-        raise ValueError('Unhandled Amazon Feeds api error: {0}.'.format(e))
+    feed_ids, failed = submit_feed(xml_quantity_helper, 'quantity', messages)
 
-    xml_quantity_helper.reload_tree()
-
-    if response.parsed['FeedSubmissionInfo']['FeedProcessingStatus']['value'] != '_SUBMITTED_':
-        raise ValueError('Feeds Api did not accept messages to update quantities. Status: {0}. Messages: {1}.'
-                         .format(response.parsed['FeedSubmissionInfo']['FeedProcessingStatus']['value'], messages))
+    if len(failed):
+        logger.warning('Quantities are not updated and will be updated next time: {0}, SKUs: {1}.'.format(
+            len(failed), [sku for sku, _ in failed]
+        ))
 
     logger.info('Pairs quantity update complete.')
+    return feed_ids
 
 
 def get_prices(asins):
-    """ Get BuyBox or lowest listing prices for all asins with delay request period """
+    """
+    Get BuyBox or lowest listing prices for all asins and save them as current prices
+
+    :return: dictionary in format: asin: price
+    """
 
-    prices = get_item_price_info(asins, logger)
+    prices_info = get_item_price_info(asins, logger)
 
-    if prices is None:
+    if prices_info is None:
         return
 
-    for i in range(len(prices)):
-        pair = Pair.objects.get(asin=prices[i][0])
+    pairs = Pair.objects.in_bulk_asins(asins)
+    prices = {}
 
-        if not prices[i][1]:
-            prices[i][1] = pair.amazon_approximate_price
+    for asin, price, _ in prices_info:
+        if asin not in pairs:
+            continue
 
-        pair.amazon_current_price = prices[i][1]
-        pair.save(update_fields=['amazon_current_price'])
+        prices[asin] = price if price else pairs[asin].amazon_approximate_price
 
+    set_prices_local(prices, for_current_price=True)
     logger.info('Lowest prices received.')
     return prices
 
 
 def set_prices(asins_prices):
-    """ Set correct prices by given asins and price values """
-
-    messages = [(Pair.objects.get(asin=asin[0]).seller_sku, round(asin[1], constants.price_digits))
-                for asin in asins_prices]
+    """
+    Set correct prices by given dictionary in format: asin: price
 
-    if len(messages):
-        xml_price_helper.make_body(messages)
-    else:
-        logger.warning('No messages to set price in Amazon.')
-        return
+    :return: tuple: (list of feed submission ids, set of SKUs of not accepted chunks)
+    """
 
-    try:
-        response = amazon_feeds_api.api.submit_feed(feed=xml_price_helper.tree,
-                                                    feed_type=amazon_feeds_api.feed_types['price'],
-                                                    marketplaceids=[amazon_feeds_api.region])
+    skus = dict(Pair.objects.filter(asin__in=list(asins_prices)).values_list('asin', 'seller_sku'))
+    messages = [(skus[asin], round(price, constants.price_digits)) for asin, price in asins_prices.items()
+                if asin in skus]
 
-    except amazon_feeds_api.connection_error as e:
-        xml_price_helper.reload_tree()
-        raise ValueError('Unhandled Amazon Feeds api error: {0}.'.format(e))
+    if not len(messages):
+        logger.warning('No messages to set price in Amazon.')
+        return [], set()
 
-    xml_price_helper.reload_tree()
+    feed_ids, failed = submit_feed(xml_price_helper, 'price', messages)
+    failed_skus = {sku for sku, _ in failed}
 
-    if response.parsed['FeedSubmissionInfo']['FeedProcessingStatus']['value'] != '_SUBMITTED_':
-        raise ValueError('Feeds Api did not accept messages to set prices. Status: {0}. Messages: {1}.'
-                         .format(response.parsed['FeedSubmissionInfo']['FeedProcessingStatus']['value'], messages))
+    if len(failed_skus):
+        logger.warning('Prices are not set: {0}, SKUs: {1}.'.format(len(failed_skus), sorted(failed_skus)))
 
     logger.info('Prices are set')
+    return feed_ids, failed_skus
 
 
 def set_prices_local(asins_prices, for_min_price=False, for_current_price=False):
-    """ Set Amazon approximate or minimum prices in db """
+    """ Set Amazon approximate, minimum or current prices in db by dictionary in format: asin: price """
 
-    for message in asins_prices:
-        pair = Pair.objects.get(asin=message[0])
+    if for_current_price:
+        field = 'amazon_current_price'
 
-        if for_current_price:
-            pair.amazon_current_price = message[1]
-            pair.save(update_fields=['amazon_current_price'])
-            continue
+    elif for_min_price:
+        field = 'amazon_minimum_price'
 
-        if not for_min_price:
-            pair.amazon_approximate_price = message[1]
-            pair.save(update_fields=['amazon_approximate_price'])
+    else:
+        field = 'amazon_approximate_price'
 
-        else:
-            pair.amazon_minimum_price = message[1]
-            pair.save(update_fields=['amazon_minimum_price'])
+    pairs = Pair.objects.in_bulk_asins(asins_prices)
 
+    for asin, pair in pairs.items():
+        setattr(pair, field, asins_prices[asin])
 
-def calc_app_price(input_ebay_prices, for_min_price=False):
-    """ Calculate Amazon approximate or minimum price """
+    Pair.objects.bulk_update(pairs.values(), [field], batch_size=constants.bulk_batch_size)
 
-    prices, ebay_prices = [], []
 
-    for ebay_price in input_ebay_prices:
-        if not ebay_price:
-            continue
+def workflow_schedule(run, step):
+    """
+    Complete the current workflow step, save the next one and schedule its execution,
+    feeds of the completed wait are kept only for the step that waited for them
+    """
+
+    run.complete_steps()
+
+    if step != run.step:
+        run.feed_ids = []
+
+    run.step = step
+    run.feed_tries = 0
+    run.feeds_submitted = None
+    run.save_state('step', 'feed_tries', 'feed_ids', 'feeds_submitted', 'asins', 'reconciled', 'steps_times')
+
+    countdown = 0
+
+    if step == 'check_after' and not run.reconciled:
+        # give Amazon time to process the uploads
+
+        countdown = constants.check_after_delay
+
+    workflow_step.apply_async((run.id, run.chain), countdown=countdown)
+
+
+def workflow_wait(run, feed_ids, step):
+    """ Schedule feeds status polling, the next step starts when all feeds are done """
 
-        for interval in constants.profit_intervals:
-            if interval[0] <= ebay_price < interval[1]:
-                price = ebay_price * constants.profit_intervals[interval] / constants.profit_percentage
-                prices.append(price)
-                ebay_prices.append(ebay_price)
-                break
+    if not len(feed_ids):
+        workflow_schedule(run, step)
+        return
 
-    # getting approximate price
+    run.step = step
+    run.feed_ids = feed_ids
+    run.feed_tries = 0
+    run.poll_attempt = 0
+    run.feeds_submitted = datetime.now(get_current_timezone())
+    run.save_state('step', 'feed_ids', 'feed_tries', 'poll_attempt', 'feeds_submitted', 'asins')
+    workflow_poll.apply_async((run.id, run.chain), countdown=feed_tracker.next_delay(0))
 
-    if not len(prices):
-        print(input_ebay_prices)
-        return 0
 
-    max_ebay_price_coeff = 0
-    max_price = max(prices)
-    max_ebay_price = ebay_prices[prices.index(max_price)]
+def workflow_feed(run, failure_message, func, *args):
+    """
+    Amazon SubmitFeed failure handler, returns the func result
+    or None if the current step is rescheduled for retry
+    """
 
-    for interval in constants.amazon_approximate_price_percent:
-        if interval[0] <= max_ebay_price < interval[1]:
-            max_ebay_price_coeff = constants.amazon_approximate_price_percent[interval]
+    try:
+        return func(*args)
 
-    if not for_min_price:
-        return round(max_price + max_ebay_price * max_ebay_price_coeff, 2)
+    except ValueError as e:
+        run.feed_tries += 1
 
-    return round(min(prices), 2)
+        if run.feed_tries >= run.tries:
+            raise WorkflowError(failure_message, 300)
 
+        logger.warning('Feed submit failed, step: {0}, try: {1}, error: {2}'.format(run.step, run.feed_tries, e))
+        run.save_state('feed_tries')
+        workflow_step.apply_async((run.id, run.chain), countdown=run.delay // 2)
 
-def empty_app_prices(for_min_price=False):
-    """ Populate empty approximate or minimum Amazon prices in db """
 
-    asins_prices = []
+def workflow_finish(run):
+    run.complete_steps()
+    run.step = 'done'
+    run.finished = datetime.now(get_current_timezone())
+    run.save_state('step', 'finished', 'asins', 'reconciled', 'steps_times')
+    logger.info('Amazon workflow complete, run: {0}'.format(run.id))
 
-    if not for_min_price:
-        ebay_ids = [(pair.asin, pair.ebay_ids.split(';')) for pair in Pair.objects.all()
-                    if not pair.amazon_approximate_price]
 
+def workflow_fail(run, error):
+    """ Check upload results in a failure case, if they are not reconciled yet """
+
+    logger.critical('Workflow failed with error: {0}'.format(error))
+
+    if len(run.asins) and not run.reconciled and run.step != 'check_after':
+        workflow_schedule(run, 'check_after')
     else:
-        ebay_ids = [(pair.asin, pair.ebay_ids.split(';')) for pair in Pair.objects.all()
-                    if not pair.amazon_minimum_price]
+        workflow_finish(run)
 
-    for pair_info in ebay_ids:
-        ebay_price = []
 
-        for ebay_id in pair_info[1]:
-            response = ebay_trading_api.api.execute('GetItem', {'ItemID': ebay_id})
-            ebay_price.append(get_ebay_price_from_response(response))
+def workflow_resume(run):
+    """ Restart the task chain of the run from its last not completed step """
 
-        ebay_price_set = set(ebay_price)
+    run.chain += 1
+    run.save_state('chain')
+    logger.info('Amazon workflow resumes, run: {0}, step: {1}'.format(run.id, run.step))
 
-        if len(ebay_price_set) == 1 and not list(ebay_price_set)[0]:
-            print(pair_info[0])
+    if len(run.feed_ids) and run.feeds_submitted is not None:
+        # the run was waiting for feeds, waiting time starts again
 
-        else:
-            app_price = calc_app_price(ebay_price, for_min_price)
+        run.feeds_submitted = datetime.now(get_current_timezone())
+        run.poll_attempt = 0
+        run.save_state('feeds_submitted', 'poll_attempt')
+        workflow_poll.delay(run.id, run.chain)
+    else:
+        workflow_step.delay(run.id, run.chain)
 
-            if not app_price:
-                print(pair_info[0])
 
-            asins_prices.append((pair_info[0], app_price))
+def step_check_before(run):
+    """ Check for already existing products """
 
-    set_prices_local(asins_prices, for_min_price)
-    print('Done')
+    check_products(check_type='check_before')
+    workflow_schedule(run, 'upload')
 
 
-def feed_cycle(tries, delay, failure_message, func, *args, for_upload=False):
-    """ Amazon SubmitFeed failure handler """
+def step_upload(run):
+    """ Upload new products, pairs ids are stored before SKUs generation to make the step repeatable """
 
-    asins = []
+    if not len(run.pair_ids):
+        run.pair_ids = list(Pair.objects.filter(seller_sku='').filter(checked=1).values_list('id', flat=True))
+        run.save_state('pair_ids')
 
-    while tries:
-        try:
-            if for_upload:
-                asins = func(*args)
-            else:
-                func(*args)
+    result = workflow_feed(run, 'Workflow failed on pairs uploading', upload_new_pairs, run.pair_ids)
 
-            break
+    if result is None:
+        return
+
+    run.asins, feed_ids = result
 
-        except ValueError:
-            sleep(delay // 2)
-            tries -= 1
+    if not len(run.asins):
+        workflow_schedule(run, 'quantity')
+        return
 
-    if not tries:
-        raise WorkflowError(failure_message, 300)
+    workflow_wait(run, feed_ids, 'reconcile')
 
-    return asins
 
+def step_reconcile(run):
+    """ Mark failed uploads by feed processing reports """
 
-def check_feed_done(delay=60, max_cycle_count=90):
-    """ Check until the feeds request is completed """
+    failed_asins = reconcile_feed_results(run.feed_ids)
 
-    def check_result():
-        try:
-            response = amazon_feeds_api.api.get_feed_submission_list(max_count='1')
+    if failed_asins is not None:
+        run.reconciled = True
+        run.asins = [asin for asin in run.asins if asin not in failed_asins]
 
-        except amazon_feeds_api.connection_error as e:
-            logger.critical('Unhandled Amazon Feeds api error: {0}.'.format(e))
-            return False
+    workflow_schedule(run, 'quantity')
 
-        if response.parsed['FeedSubmissionInfo']['FeedProcessingStatus']['value'] == '_DONE_':
-            return True
 
-        return False
+def step_quantity(run):
+    """ Update quantities """
 
-    i_count = 0
+    feed_ids = workflow_feed(run, 'Workflow failed on quantity updating', update_pairs_quantity)
+
+    if feed_ids is None:
+        return
+
+    if not len(run.asins):
+        logger.info('Empty asins list before getting prices')
+        workflow_finish(run)
+        return
+
+    workflow_wait(run, feed_ids, 'prices')
+
+
+def step_prices(run):
+    """ Get prices from Amazon and set them by uploaded asins """
+
+    prices = get_prices(run.asins)
+
+    if prices is None:
+        logger.critical('Empty prices list before setting prices')
+        workflow_finish(run)
+        return
+
+    result = workflow_feed(run, 'Workflow failed on setting prices', set_prices, prices)
+
+    if result is None:
+        return
+
+    feed_ids, _ = result
+    workflow_wait(run, feed_ids, 'check_after')
 
-    while True:
-        if check_result():
-            break
 
-        i_count += 1
+def step_check_after(run):
+    """ Check upload results if processing reports were unavailable """
 
-        if i_count > max_cycle_count:
-            raise WorkflowError('Feed submission processing is out of time', 200)
+    if not run.reconciled:
+        check_products(check_type='check_after', asins=run.asins, after_delay=0)
 
-        sleep(delay)
+    workflow_finish(run)
+
+
+workflow_steps = {
+    'check_before': step_check_before,
+    'upload': step_upload,
+    'reconcile': step_reconcile,
+    'quantity': step_quantity,
+    'prices': step_prices,
+    'check_after': step_check_after
+}
 
 
 @shared_task(name='Amazon workflow')
 def amazon_update(delay=constants.amazon_workflow_delay, tries=3):
     """
-    Amazon items update workflow
+    Amazon items update workflow, runs as a chain of workflow_step tasks linked by
+    countdown scheduling and feeds polling callbacks, the run state is stored in WorkflowRun
+
+    Not finished run is resumed from its last not completed step if it is stale
+    (e.g. after a worker crash), otherwise a new run is not started until it finishes
 
-    :param delay: sleep period in seconds between workflow operations
+    :param delay: sleep period in seconds for SubmitFeed failure retries
     :param tries: number of tries in SubmitFeed failure case
     """
 
-    asins = []
-    logger.info('Amazon workflow starts')
-
     if tries <= 0:
         raise ValueError('Tries value must be positive')
 
-    try:
-        # check for already existing products
+    run = WorkflowRun.objects.filter(finished__isnull=True).order_by('-created').first()
 
-        check_products(check_type='check_before')
+    if run is not None:
+        if (datetime.now(get_current_timezone()) - run.updated).total_seconds() < constants.workflow_stale_timeout:
+            logger.warning('Amazon workflow run {0} is still in progress, step: {1}'.format(run.id, run.step))
+            return
 
-        # upload new products
+        workflow_resume(run)
+        return
 
-        asins = feed_cycle(tries, delay, 'Workflow failed on pairs uploading', upload_new_pairs, for_upload=True)
+    run = WorkflowRun.objects.create(delay=delay, tries=tries)
+    logger.info('Amazon workflow starts, run: {0}'.format(run.id))
+    workflow_step.delay(run.id, run.chain)
 
-        if len(asins):
-            sleep(delay)
-            check_feed_done()
 
-        # update quantities
+@shared_task(name='Amazon workflow step')
+def workflow_step(run_id, chain=0):
+    """ Execute the current step of the workflow run """
 
-        feed_cycle(tries, delay, 'Workflow failed on quantity updating', update_pairs_quantity)
+    run = WorkflowRun.objects.get(id=run_id)
 
-        if not len(asins):
-            logger.info('Empty asins list before getting prices')
-            return
+    if run.step == 'done' or run.chain != chain:
+        return
 
-        sleep(delay)
-        check_feed_done()
+    run.start_step()
+    run.save_state('steps_times')
 
-        # get prices from Amazon
+    try:
+        workflow_steps[run.step](run)
 
-        prices = get_prices(asins)
+    except WorkflowError as e:
+        workflow_fail(run, e)
 
-        if prices is None:
-            logger.critical('Empty prices list before setting prices')
-            return
 
-        # set prices by uploaded asins
+@shared_task(name='Amazon workflow feeds check')
+def workflow_poll(run_id, chain=0):
+    """ Check the workflow run feeds, reschedule itself with backoff until they are done """
 
-        feed_cycle(tries, delay, 'Workflow failed on setting prices', set_prices, prices)
-        sleep(delay)
-        check_feed_done()
+    run = WorkflowRun.objects.get(id=run_id)
 
-        # check upload results
+    if run.step == 'done' or run.chain != chain:
+        return
 
-        check_products(check_type='check_after', asins=asins)
-        logger.info('Amazon workflow complete')
+    pending = feed_tracker.poll(run.feed_ids)
 
-    except WorkflowError as e:
-        logger.critical('Workflow failed with error: {0}'.format(e))
+    if not len(pending):
+        feed_tracker.forget(run.feed_ids)
+        workflow_schedule(run, run.step)
+        return
+
+    run.poll_attempt += 1
+    delay = feed_tracker.next_delay(run.poll_attempt)
+    waiting_time = (datetime.now(get_current_timezone()) - run.feeds_submitted).total_seconds()
 
-        if len(asins):
-            if e.code != 300:
-                check_feed_done()
+    if waiting_time + delay > constants.amazon_feed_wait_timeout:
+        feed_tracker.forget(run.feed_ids)
+        workflow_fail(run, WorkflowError('Feed submission processing is out of time', 200))
+        return
 
-            check_products(check_type='check_after', asins=asins)
+    run.save_state('poll_attempt')
+    workflow_poll.apply_async((run.id, run.chain), countdown=delay)
 
 
 @shared_task(name='Delete old unsuitable pairs')
 def delete_pairs_unsuitable():
     """ Delete old pairs with unsuitable status from db and then from Amazon inventory """
 
-    messages = []
+    pairs = Pair.objects.filter(created__lte=datetime.now(get_current_timezone()) - timedelta(
+        days=constants.pair_unsuitable_days_live)).filter(checked__gte=2)
 
-    for pair in Pair.objects.filter(created__lte=datetime.now(get_current_timezone()) - timedelta(
-           days=constants.pair_unsuitable_days_live)).filter(checked__gte=2):
-        if len(pair.seller_sku):
-            messages.append((pair.seller_sku,))
+    messages = [(sku,) for sku in pairs.exclude(seller_sku='').values_list('seller_sku', flat=True)]
 
-        if not Order.objects.filter(items=pair).exists():
-            pair.delete()
+    # pairs with orders stay in db
 
-    logger.info('Old pairs with unsuitable status deleted from db')
+    delete_in_chunks(pairs.annotate(
+        has_orders=Exists(Order.items.through.objects.filter(pair_id=OuterRef('pk')))
+    ).filter(has_orders=False), 'old unsuitable pairs', logger)
 
-    if len(messages):
-        xml_delete_product_helper.make_body(messages)
-    else:
+    if not len(messages):
         logger.warning('No messages to delete products in Amazon.')
         return
 
     # delete filtered products from Amazon
 
     try:
-        response = amazon_feeds_api.api.submit_feed(feed=xml_delete_product_helper.tree,
-                                                    feed_type=amazon_feeds_api.feed_types['delete_product'],
-                                                    marketplaceids=[amazon_feeds_api.region])
+        submit_feed(xml_delete_product_helper, 'delete_product', messages)
 
-    except amazon_feeds_api.connection_error as e:
-        xml_delete_product_helper.reload_tree()
-        logger.critical('Unhandled Amazon Feeds api error: {0}.'.format(e))
-        return
-
-    xml_delete_product_helper.reload_tree()
-
-    if response.parsed['FeedSubmissionInfo']['FeedProcessingStatus']['value'] != '_SUBMITTED_':
-        logger.critical('Feeds Api did not accept messages to delete products. Status: {0}. Messages: {1}.'
-                        .format(response.parsed['FeedSubmissionInfo']['FeedProcessingStatus']['value'], messages))
+    except ValueError as e:
+        logger.critical('Deleting products from Amazon failed: {0}'.format(e))
         return
 
     logger.info('Old pairs deleted from Amazon')
 
 
 @shared_task(name='Check new orders')
-def check_orders(token: str = None) -> None:
-    """ Get last day orders and create Order objects in db """
+def check_orders() -> None:
+    """
+    Get orders updated since the last sync and create Order objects in db,
+    sync position is stored in the 'orders' cursor and moved only after all pages are processed,
+    it is kept before the earliest order whose items were not received, so the order is checked again
+    """
+
+    cursor, _ = SyncCursor.objects.get_or_create(name='orders', defaults={
+        'position': datetime.now(get_current_timezone()) - timedelta(days=constants.orders_first_sync_days)
+    })
 
-    if token is None:
-        date = datetime.now() - timedelta(days=3)
-        date = datetime.strftime(date, '%Y-%m-%dT%H:%M:%S')
+    token, position, pages, failed = None, None, 0, []
 
+    while True:
         try:
-            response = amazon_orders_api.api.list_orders(created_after=date, marketplaceids=[amazon_orders_api.region])
+            if token is None:
+                response = amazon_orders_api.api.list_orders(
+                    lastupdatedafter=cursor.position.astimezone(utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    marketplaceids=[amazon_orders_api.region]
+                )
+
+                # the first page has the time to use as LastUpdatedAfter in the next sync
+
+                position = datetime.strptime(response.parsed['LastUpdatedBefore']['value'][:19],
+                                             '%Y-%m-%dT%H:%M:%S').replace(tzinfo=utc)
+
+            else:
+                response = amazon_orders_api.api.list_orders(next_token=token)
 
         except amazon_orders_api.connection_error as e:
-            logger.critical('Amazon Orders api unhandled error: {0}.'.format(e))
+            logger.critical('Amazon Orders api unhandled error: {0}, pages processed: {1}.'.format(e, pages))
             return
 
-    else:
-        logger.info(f'Check orders with token: {token}.')
+        failed += process_orders_page(get_orders_from_response(response))
+        pages += 1
 
         try:
-            response = amazon_orders_api.api.list_orders(next_token=token)
+            token = response.parsed['NextToken']['value']
 
-        except amazon_orders_api.connection_error as e:
-            logger.critical('Amazon Orders api unhandled error: {0}.'.format(e))
-            return
+        except KeyError:
+            break
+
+    if len(failed):
+        position = min(position, min(failed) - timedelta(seconds=1))
+        logger.warning('Orders items were not received for {0} orders, they will be checked again.'.format(
+            len(failed)))
+
+    cursor.position = position
+    cursor.save()
+
+    logger.info('Check for new orders complete, pages: {0}, synced up to: {1}.'.format(pages, position))
 
-    # process orders
+
+def get_orders_from_response(response) -> list:
+    """ Get orders list from ListOrders response """
 
     if not len(response.parsed['Orders']):
-        logger.warning('There are no orders in response.')
-        return
+        return []
+
+    orders = response.parsed['Orders']['Order']
 
     try:
-        response.parsed['Orders']['Order'][0]
+        orders[0]
 
     except KeyError:
-        process_order(response.parsed['Orders']['Order'])
+        return [orders]
 
-    else:
-        for order in response.parsed['Orders']['Order']:
-            process_order(order)
+    return list(orders)
 
-    # check next token
 
-    try:
-        response.parsed['NextToken']['value']
+def process_orders_page(orders: list) -> list:
+    """
+    Process page of orders from ListOrders response: skip already existing orders, resolve all
+    ordered ASINs with one query and create orders with their items in bulk
 
-    except KeyError:
-        pass
+    :return: list of LastUpdateDate times of orders which items were not received
+    """
 
-    else:
-        check_orders(token=response.parsed['NextToken']['value'])
+    existing = set(Order.objects.filter(
+        order_id__in=[order['AmazonOrderId']['value'] for order in orders]
+    ).values_list('order_id', flat=True))
 
-    if token is None:
-        logger.info('Check for new orders complete.')
+    orders_items, failed = {}, []
 
+    for order in orders:
+        order_id = order['AmazonOrderId']['value']
 
-def process_order(order) -> None:
-    """ Process Amazon order from ListOrders response """
+        if order['OrderStatus']['value'] != 'Unshipped' or order_id in existing:
+            continue
 
-    if order['OrderStatus']['value'] != 'Unshipped':
-        return
+        order_items = get_order_items(order_id)
 
-    new_order = Order()
-    new_order.order_id = order['AmazonOrderId']['value']
+        if order_items is None:
+            failed.append(datetime.strptime(order['LastUpdateDate']['value'][:19],
+                                            '%Y-%m-%dT%H:%M:%S').replace(tzinfo=utc))
 
-    # check if order already exists
+        else:
+            orders_items[order_id] = order, order_items
 
-    if Order.objects.filter(order_id=new_order.order_id).exists():
-        return
+    if not len(orders_items):
+        return failed
 
-    # parse order shipping info
+    pairs = Pair.objects.in_bulk_asins(
+        item['ASIN']['value'] for _, order_items in orders_items.values() for item in order_items
+    )
 
-    new_order.shipping_info = {'BuyerName': order['BuyerName']['value']}
+    new_orders, orders_pairs = [], []
 
-    try:
-        order['ShippingAddress']
+    for order_id, (order, order_items) in orders_items.items():
+        new_order = build_order(order, order_items, pairs)
 
-    except KeyError:
-        pass
+        if new_order is not None:
+            new_orders.append(new_order[0])
+            orders_pairs.append(new_order[1])
 
-    else:
-        for field in shipping_info_fields:
-            try:
-                new_order.shipping_info[field] = order['ShippingAddress'][field]['value']
+    if not len(new_orders):
+        return failed
 
-            except KeyError:
-                continue
+    through = Order.items.through
+
+    with transaction.atomic():
+        Order.objects.bulk_create(new_orders, batch_size=constants.bulk_batch_size)
+
+        through.objects.bulk_create([
+            through(order_id=new_order.id, pair_id=pair.id)
+            for new_order, order_pairs in zip(new_orders, orders_pairs) for pair in order_pairs
+        ], batch_size=constants.bulk_batch_size)
 
-    # get first list response
+    logger.info('New orders created: {0}.'.format([new_order.order_id for new_order in new_orders]))
+    return failed
+
+
+def get_order_items(order_id: str) -> (list, None):
+    """ Get all order items from ListOrderItems responses, None if any of the requests failed """
 
     responses = []
 
     try:
-        responses.append(amazon_orders_api.api.list_order_items(new_order.order_id))
+        responses.append(amazon_orders_api.api.list_order_items(order_id))
 
     except amazon_orders_api.connection_error as e:
         logger.warning('Amazon Orders api unhandled error: {0}.'.format(e))
@@ -629,95 +785,95 @@ def process_order(order) -> None:
 
     while True:
         try:
-            responses[-1].parsed['NextToken']['value']
+            token = responses[-1].parsed['NextToken']['value']
 
         except KeyError:
             break
 
-        else:
-            try:
-                responses.append(
-                    amazon_orders_api.api.list_order_items(next_token=responses[-1].parsed['NextToken']['value'])
-                )
-
-            except amazon_orders_api.connection_error as e:
-                logger.warning('Amazon Orders api unhandled error: {0}.'.format(e))
-                break
+        try:
+            responses.append(amazon_orders_api.api.list_order_items(next_token=token))
 
-    # process responses
+        except amazon_orders_api.connection_error as e:
+            logger.warning('Amazon Orders api unhandled error: {0}.'.format(e))
+            return
 
     items = []
-    new_order.amazon_price = 0
-    new_order.items_counts = {}
 
-    for response_order in responses:
+    for response in responses:
+        order_items = response.parsed['OrderItems']['OrderItem']
+
         try:
-            response_order.parsed['OrderItems']['OrderItem'][0]
+            order_items[0]
 
         except KeyError:
-            # in one item case
+            items.append(order_items)
 
-            try:
-                item = Pair.objects.get(asin=response_order.parsed['OrderItems']['OrderItem']['ASIN']['value'])
+        else:
+            items += order_items
 
-            except Pair.DoesNotExist:
-                continue
+    return items
 
-            quantity = int(response_order.parsed['OrderItems']['OrderItem']['QuantityOrdered']['value'])
-            new_order.items_counts.update({item.id: quantity})
 
-            item_price = float(response_order.parsed['OrderItems']['OrderItem']['ItemPrice']['Amount']['value'])
+def build_order(order, order_items: list, pairs: dict) -> (tuple, None):
+    """
+    Create not saved Order object by ListOrders order and its items
 
-            try:
-                item_tax = float(response_order.parsed['OrderItems']['OrderItem']['ItemTax']['Amount']['value'])
+    :param order: order from ListOrders response
+    :param order_items: order items from ListOrderItems responses
+    :param pairs: dictionary with ordered pairs in format: asin: pair
+    :return: tuple: (Order object, list of ordered pairs) or None if there are no known items in the order
+    """
 
-            except (KeyError, ValueError):
-                item_tax = 0
+    items = {}
+    new_order = Order(order_id=order['AmazonOrderId']['value'], amazon_price=0, items_counts={})
 
-            new_order.amazon_price += item_price + item_tax
+    for order_item in order_items:
+        try:
+            item = pairs[order_item['ASIN']['value']]
 
-            items.append(item)
+        except KeyError:
+            continue
 
-        else:
-            # in multiple items case
+        new_order.items_counts[item.id] = int(order_item['QuantityOrdered']['value'])
 
-            amazon_price = 0
-            items_counts = {}
+        item_price = float(order_item['ItemPrice']['Amount']['value'])
 
-            for response_item in response_order.parsed['OrderItems']['OrderItem']:
-                try:
-                    item = Pair.objects.get(asin=response_item['ASIN']['value'])
+        try:
+            item_tax = float(order_item['ItemTax']['Amount']['value'])
 
-                except Pair.DoesNotExist:
-                    pass
+        except (KeyError, ValueError):
+            item_tax = 0
 
-                else:
-                    items_counts[item.id] = int(response_item['QuantityOrdered']['value'])
+        new_order.amazon_price += item_price + item_tax
+        items[item.id] = item
 
-                    item_price = float(response_item['ItemPrice']['Amount']['value'])
+    if not len(items):
+        return
 
-                    try:
-                        item_tax = float(response_item['ItemTax']['Amount']['value'])
+    # parse order shipping info
 
-                    except (KeyError, ValueError):
-                        item_tax = 0
+    new_order.shipping_info = {'BuyerName': order['BuyerName']['value']}
 
-                    amazon_price += item_price + item_tax
+    try:
+        order['ShippingAddress']
 
-                    items.append(item)
+    except KeyError:
+        pass
 
-            new_order.items_counts.update(items_counts)
-            new_order.amazon_price += amazon_price
+    else:
+        for field in shipping_info_fields:
+            try:
+                new_order.shipping_info[field] = order['ShippingAddress'][field]['value']
 
-    if not len(items):
-        return
+            except KeyError:
+                continue
 
     date = order['PurchaseDate']['value']
     date = datetime.strptime(date[:date.find('.')], '%Y-%m-%dT%H:%M:%S') - timedelta(hours=8)
     new_order.purchase_date = date.date()
-    new_order.save()
-    new_order.items.add(*items)
-    new_order.set_multi()
+    new_order.multi = len({item.owner_id for item in items.values()}) > 1
+
+    return new_order, list(items.values())
 
 
 class WorkflowError(Exception):
@@ -0,0 +1,38 @@
+from django.test import TestCase
+
+from ..parsers import get_failed_skus_from_report
+
+report = '''<?xml version="1.0" encoding="UTF-8"?>
+<AmazonEnvelope>
+    <Header><DocumentVersion>1.02</DocumentVersion></Header>
+    <MessageType>ProcessingReport</MessageType>
+    <Message>
+        <MessageID>1</MessageID>
+        <ProcessingReport>
+            <DocumentTransactionID>1</DocumentTransactionID>
+            <StatusCode>Complete</StatusCode>
+            <Result>
+                <MessageID>1</MessageID>
+                <ResultCode>Error</ResultCode>
+                <ResultDescription>Invalid product</ResultDescription>
+                <AdditionalInfo><SKU>AAAAAAAAAA</SKU></AdditionalInfo>
+            </Result>
+            <Result>
+                <MessageID>2</MessageID>
+                <ResultCode>Warning</ResultCode>
+                <AdditionalInfo><SKU>BBBBBBBBBB</SKU></AdditionalInfo>
+            </Result>
+        </ProcessingReport>
+    </Message>
+</AmazonEnvelope>
+'''
+
+
+class FailedSkusReportTest(TestCase):
+    """ Test feed processing report parsing, mws keeps the report as text or bytes """
+
+    def test_text_report(self):
+        self.assertEqual(get_failed_skus_from_report(report), {'AAAAAAAAAA'})
+
+    def test_bytes_report(self):
+        self.assertEqual(get_failed_skus_from_report(report.encode('utf8')), {'AAAAAAAAAA'})
@@ -0,0 +1,39 @@
+from django.test import TestCase
+
+from ..profit import ProfitEngine
+
+
+class ProfitEngineTest(TestCase):
+    """ Test ProfitEngine calculations """
+
+    def setUp(self) -> None:
+        self.engine = ProfitEngine()
+
+    def test_check_profit(self):
+        result = self.engine.check_profit(0, [9.99, 10, 0])
+        self.assertEqual(result, (True, round(10 * 1.27 / 0.85, 2), round(9.99 * 1.3 / 0.85 + 9.99 * 0.15, 2)))
+
+        result = self.engine.check_profit(15, [9.99, 10])
+        self.assertEqual(result, (False, None, None))
+
+        result = self.engine.check_profit(0, [0, 0])
+        self.assertEqual(result, (False, None, None))
+
+    def test_check_profits(self):
+        checked, minimum_prices, approximate_prices = self.engine.check_profits(
+            [0, 100, 20], [[5, 0], [30, 45], [15, 0]]
+        )
+
+        self.assertEqual(list(checked), [True, True, False])
+        self.assertEqual(minimum_prices[1], round(min(30 * 1.22, 45 * 1.12) / 0.85, 2))
+        self.assertEqual(approximate_prices[0], round(5 * 1.3 / 0.85 + 5 * 0.15, 2))
+
+    def test_round(self):
+        values = [0.125, 2.675, 1.005, 0.285, 10.555]
+        self.assertEqual(list(self.engine.round(values)), [round(value, 2) for value in values])
+
+    def test_guard_prices(self):
+        prices, minimum_granted = self.engine.guard_prices([0, 5, 12], [8, 8, 8], [20, 20, 20])
+
+        self.assertEqual(list(prices), [20, 8, 12])
+        self.assertEqual(list(minimum_granted), [False, True, False])
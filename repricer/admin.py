@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import RepricerStats
+from .models import RepricerStats, RepriceSchedule
 
 
 @admin.register(RepricerStats)
@@ -8,3 +8,11 @@ class RepricerStatsAdmin(admin.ModelAdmin):
     readonly_fields = 'created',
     ordering = '-created',
     list_filter = 'created',
+
+
+@admin.register(RepriceSchedule)
+class RepriceScheduleAdmin(admin.ModelAdmin):
+    model = RepriceSchedule
+    readonly_fields = 'updated',
+    ordering = 'next_run',
+    list_filter = 'tier',
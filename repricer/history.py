@@ -0,0 +1,134 @@
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Trunc
+from django.utils.timezone import get_current_timezone
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from config import constants
+from utils import delete_in_chunks
+from .models import PriceSnapshot
+from .simulation import PriceHistory
+from .strategies import BUYBOX_NONE
+
+
+def record_snapshots(pairs: list, prices: list, buybox_statuses: list, our_prices: list) -> None:
+    """ Append price observations of pairs to the history """
+
+    PriceSnapshot.objects.bulk_create([
+        PriceSnapshot(pair_id=pair.id, price=price, is_buybox_winner=status, our_price=our_price)
+        for pair, price, status, our_price in zip(pairs, prices, buybox_statuses, our_prices)
+    ], batch_size=constants.bulk_batch_size)
+
+
+def get_downsampled_snapshots(start: datetime, end: datetime):
+    """ Get queryset of snapshots in the time range which have a newer snapshot of the same pair in the same hour """
+
+    newer = PriceSnapshot.objects.annotate(hour=Trunc('created', 'hour')).filter(
+        pair_id=OuterRef('pair_id'), hour=OuterRef('hour'), created__gt=OuterRef('created')
+    )
+
+    return PriceSnapshot.objects.filter(created__gte=start, created__lt=end).annotate(
+        hour=Trunc('created', 'hour')
+    ).annotate(has_newer=Exists(newer)).filter(has_newer=True)
+
+
+def compact_snapshots(logger) -> None:
+    """
+    Downsample snapshots older than raw period to the last one per pair and hour,
+    delete snapshots older than retention period
+    """
+
+    from pairs.models import SyncCursor
+
+    now = datetime.now(get_current_timezone())
+    border = now - timedelta(days=constants.price_history_raw_days)
+    cursor, _ = SyncCursor.objects.get_or_create(name='price_history', defaults={
+        'position': now - timedelta(days=constants.price_history_days)
+    })
+
+    if cursor.position < border:
+        delete_in_chunks(get_downsampled_snapshots(cursor.position, border), 'downsampled price snapshots', logger)
+
+        cursor.position = border
+        cursor.save()
+
+    delete_in_chunks(PriceSnapshot.objects.filter(
+        created__lt=now - timedelta(days=constants.price_history_days)
+    ), 'old price snapshots', logger)
+
+
+def export_price_history(directory: str, days: int, step: int = constants.price_history_export_step) -> tuple:
+    """
+    Export price snapshots of last days into the simulation history directory
+
+    Snapshots are put on the regular time grid, the last observation in the step wins,
+    steps without observations repeat the previous ones
+
+    :return: tuple: (snapshots number, items number)
+    """
+
+    from pairs.models import Pair
+
+    start = datetime.now(get_current_timezone()) - timedelta(days=days)
+    snapshots = PriceSnapshot.objects.filter(created__gte=start)
+    pair_ids = sorted(snapshots.values_list('pair_id', flat=True).distinct())
+    pairs = Pair.objects.only('id', 'amazon_minimum_price', 'amazon_approximate_price').in_bulk(pair_ids)
+    pair_ids = [pair_id for pair_id in pair_ids if pair_id in pairs]
+    columns = {pair_id: index for index, pair_id in enumerate(pair_ids)}
+    steps = int(days * 86400 // step) + 1
+
+    arrays = PriceHistory.create(directory, steps, len(pair_ids))
+    prices = arrays['prices']
+    buybox = arrays['buybox']
+    current_prices = arrays['current_prices']
+
+    prices[:] = np.nan
+    buybox[:] = BUYBOX_NONE
+    current_prices[:] = np.nan
+
+    for pair_id, created, price, status, our_price in snapshots.order_by('created', 'id').values_list(
+            'pair_id', 'created', 'price', 'is_buybox_winner', 'our_price').iterator():
+        column = columns.get(pair_id)
+        row = int((created - start).total_seconds() // step)
+
+        if column is None or row >= steps:
+            continue
+
+        prices[row, column] = price
+        buybox[row, column] = BUYBOX_NONE if status is None else int(status)
+
+        if np.isnan(current_prices[column]):
+            current_prices[column] = our_price
+
+    # repeat the last observation for steps without snapshots, prices before the first observation are unknown
+
+    for row in range(steps):
+        missed = np.isnan(prices[row])
+
+        if row:
+            prices[row][missed] = prices[row - 1][missed]
+            buybox[row][missed] = buybox[row - 1][missed]
+
+        else:
+            prices[row][missed] = 0
+
+    for column, pair_id in enumerate(pair_ids):
+        arrays['minimum_prices'][column] = pairs[pair_id].amazon_minimum_price
+        arrays['approximate_prices'][column] = pairs[pair_id].amazon_approximate_price
+
+    current_prices[:] = np.nan_to_num(current_prices)
+
+    for array in arrays.values():
+        array.flush()
+
+    return steps, len(pair_ids)
+
+
+def get_last_snapshots(pair_ids: list, days: float) -> dict:
+    """ Get the last snapshots of pairs not older than given days, dictionary format: {pair id: snapshot} """
+
+    return {snapshot.pair_id: snapshot for snapshot in PriceSnapshot.objects.filter(
+        pair_id__in=pair_ids, created__gte=datetime.now(get_current_timezone()) - timedelta(days=days)
+    ).order_by('pair_id', '-created').distinct('pair_id')}
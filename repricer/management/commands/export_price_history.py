@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from time import perf_counter
+
+from config import constants
+from repricer.history import export_price_history
+
+
+class Command(BaseCommand):
+    help = 'Export recorded price snapshots into a price history directory for repricer simulation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Price history directory')
+        parser.add_argument('--days', type=int, default=7, help='Exported history depth in days')
+        parser.add_argument('--step', type=int, default=constants.price_history_export_step,
+                            help='Seconds between exported snapshots')
+
+    def handle(self, *args, directory=None, days=7, step=constants.price_history_export_step, **options):
+        start = perf_counter()
+        snapshots, items = export_price_history(directory, days, step)
+
+        self.stdout.write(self.style.SUCCESS('Exported snapshots: {0}, items: {1}, time: {2:.1f} s'.format(
+            snapshots, items, perf_counter() - start
+        )))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from repricer.simulation import PriceHistory, simulate
+from repricer.strategies import strategies
+
+
+class Command(BaseCommand):
+    help = 'Replay recorded price history through repricing strategies without touching live prices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('history', help='Price history directory')
+        parser.add_argument('--strategy', type=int, action='append', dest='numbers',
+                            help='Strategy number, all strategies are compared by default')
+
+    def handle(self, *args, history=None, numbers=None, **options):
+        numbers = numbers or sorted(strategies)
+
+        for number in numbers:
+            if number not in strategies:
+                raise CommandError('Unknown strategy: {0}'.format(number))
+
+        try:
+            history = PriceHistory(history)
+
+        except (OSError, ValueError) as e:
+            raise CommandError('Price history loading error: {0}'.format(e))
+
+        self.stdout.write('Snapshots: {0}, items: {1}'.format(len(history), history.items_number))
+
+        for number in numbers:
+            results = simulate(history, strategies[number])
+
+            self.stdout.write('Strategy {0} ({strategy}): buybox share: {buybox_share}, margin: {margin}, '
+                              'price changes: {price_changes}, feed messages: {feed_messages}, time: {time} s'
+                              .format(number, **results))
@@ -1,13 +1,18 @@
+from django.contrib.postgres.indexes import BrinIndex
 from django.db import models
 from django.utils.timezone import get_current_timezone
 from datetime import datetime
 
+from config import constants
+
 
 class RepricerStats(models.Model):
     """ Models that provides repricer items statistics """
 
     buybox_count = models.PositiveSmallIntegerField(default=0)
     min_price_count = models.PositiveSmallIntegerField(default=0)
+    repriced_count = models.PositiveIntegerField(default=0)
+    skipped_count = models.PositiveIntegerField(default=0)
     created = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -31,3 +36,68 @@ class RepricerStats(models.Model):
         """ Get object created time in format 'hours: minutes' """
 
         return datetime.strftime(self.created.astimezone(get_current_timezone()), '%H:%M')
+
+
+class PriceSnapshot(models.Model):
+    """
+    Append-only history of repricer price observations
+
+    Table is kept narrow and is ordered by time of insertion, so it is indexed by BRIN index instead of B-tree.
+    Lookups of the last snapshots of pairs use B-tree index by pair and time.
+    Old snapshots are downsampled to one per pair and hour and deleted after retention period.
+
+    :field pair_id: pair id, not a foreign key, snapshots of deleted pairs are removed by retention
+    :field created: observation time
+    :field price: competitor buybox or lowest price, 0 if unknown
+    :field is_buybox_winner: buybox status, None if no buybox
+    :field our_price: pair price after repricing
+    """
+
+    pair_id = models.PositiveIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+    price = models.FloatField()
+    is_buybox_winner = models.NullBooleanField()
+    our_price = models.FloatField()
+
+    class Meta:
+        db_table = 'pricesnapshots'
+        indexes = [
+            BrinIndex(fields=['created'], pages_per_range=constants.price_snapshots_brin_pages),
+            models.Index(fields=['pair_id', '-created'], name='pricesnapshots_pair_created')
+        ]
+
+    def __str__(self):
+        return 'Pair: {0}, price: {1}, BB: {2}, our price: {3}'.format(
+            self.pair_id, self.price, self.is_buybox_winner, self.our_price
+        )
+
+
+class RepriceSchedule(models.Model):
+    """
+    Pair repricing tier and time of the next repricing
+
+    :field tier: repricing frequency class, hot items are repriced most often
+    :field next_run: time after which the pair is repriced by the scheduler
+    :field updated: last tier assignment time
+    """
+
+    HOT = 0
+    WARM = 1
+    COLD = 2
+
+    tiers = (
+        (HOT, 'Hot'),
+        (WARM, 'Warm'),
+        (COLD, 'Cold')
+    )
+
+    pair = models.OneToOneField('pairs.Pair', on_delete=models.CASCADE, related_name='reprice_schedule')
+    tier = models.PositiveSmallIntegerField(choices=tiers, default=COLD)
+    next_run = models.DateTimeField(db_index=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'repriceschedules'
+
+    def __str__(self):
+        return '{0}: {1}, next run: {2}'.format(self.pair_id, self.get_tier_display(), self.next_run)
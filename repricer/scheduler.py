@@ -0,0 +1,136 @@
+from django.db.models import Count, Q
+from django.utils.timezone import get_current_timezone
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from config import constants
+from .models import PriceSnapshot, RepriceSchedule
+from .strategies import BUYBOX_NONE
+
+
+def get_pairs_activity(pair_ids: list, since: datetime) -> tuple:
+    """
+    Get recent activity of pairs from orders and price snapshots
+
+    :return: tuple of arrays in pair_ids order: (orders numbers, buybox status changes numbers,
+        competitor price standard deviation to mean ratios)
+    """
+
+    from pairs.models import Order
+
+    columns = {pair_id: index for index, pair_id in enumerate(pair_ids)}
+    orders = np.zeros(len(pair_ids), dtype=int)
+
+    for pair_id, number in Order.items.through.objects.filter(order__purchase_date__gte=since.date()).values_list(
+            'pair_id').annotate(number=Count('id')):
+        if pair_id in columns:
+            orders[columns[pair_id]] = number
+
+    rows, prices, buybox = [], [], []
+
+    for pair_id, price, status in PriceSnapshot.objects.filter(created__gte=since).order_by(
+            'pair_id', 'created').values_list('pair_id', 'price', 'is_buybox_winner').iterator():
+        if pair_id in columns:
+            rows.append(columns[pair_id])
+            prices.append(price)
+            buybox.append(BUYBOX_NONE if status is None else int(status))
+
+    rows, prices, buybox = np.array(rows, dtype=int), np.array(prices, dtype=float), np.array(buybox, dtype=np.int8)
+
+    # snapshots are sorted by pairs, status changes are counted between neighbours of the same pair
+
+    changes = (rows[1:] == rows[:-1]) & (buybox[1:] != buybox[:-1])
+    churn = np.bincount(rows[1:][changes], minlength=len(pair_ids))
+
+    known = prices > 0
+    counts = np.bincount(rows[known], minlength=len(pair_ids))
+    sums = np.bincount(rows[known], weights=prices[known], minlength=len(pair_ids))
+    squares = np.bincount(rows[known], weights=prices[known] ** 2, minlength=len(pair_ids))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = sums / counts
+        volatility = np.where(counts > 0, np.sqrt(np.maximum(squares / counts - means ** 2, 0)) / means, 0)
+
+    return orders, churn, volatility
+
+
+def get_tiers(orders: np.ndarray, churn: np.ndarray, volatility: np.ndarray) -> np.ndarray:
+    """ Get repricing tiers by pairs activity """
+
+    hot = ((orders >= constants.reprice_hot_orders) | (churn >= constants.reprice_hot_churn) |
+           (volatility >= constants.reprice_hot_volatility))
+    warm = (churn >= constants.reprice_warm_churn) | (volatility >= constants.reprice_warm_volatility)
+    return np.where(hot, RepriceSchedule.HOT, np.where(warm, RepriceSchedule.WARM, RepriceSchedule.COLD))
+
+
+def update_tiers() -> dict:
+    """
+    Assign repricing tiers to in-inventory pairs, new pairs are due at once
+
+    :return: dictionary of pairs numbers by tiers
+    """
+
+    from pairs.models import Pair
+
+    now = datetime.now(get_current_timezone())
+    pair_ids = list(Pair.objects.filter(amazon_current_price__gt=0).exclude(seller_sku='').order_by('id').values_list(
+        'id', flat=True))
+    tiers = get_tiers(*get_pairs_activity(pair_ids, now - timedelta(days=constants.reprice_tier_days))).tolist()
+    schedules = {schedule.pair_id: schedule for schedule in RepriceSchedule.objects.all()}
+    created, changed = [], []
+
+    for pair_id, tier in zip(pair_ids, tiers):
+        schedule = schedules.get(pair_id)
+
+        if schedule is None:
+            created.append(RepriceSchedule(pair_id=pair_id, tier=tier, next_run=now))
+
+        elif schedule.tier != tier:
+            # items moved to more frequent tier are not waiting for the old tier interval
+
+            schedule.next_run = min(schedule.next_run, now + timedelta(seconds=constants.reprice_tier_intervals[tier]))
+            schedule.tier = tier
+            changed.append(schedule)
+
+    RepriceSchedule.objects.bulk_create(created, batch_size=constants.bulk_batch_size)
+    RepriceSchedule.objects.bulk_update(changed, ['tier', 'next_run'], batch_size=constants.bulk_batch_size)
+    RepriceSchedule.objects.filter(Q(pair__amazon_current_price__lte=0) | Q(pair__seller_sku='')).delete()
+
+    return {name: tiers.count(tier) for tier, name in RepriceSchedule.tiers}
+
+
+def get_intervals_factor() -> float:
+    """ Get tiers intervals multiplier to fit all tiers into the hourly ASINs budget """
+
+    demand = sum(number * 3600 / constants.reprice_tier_intervals[tier]
+                 for tier, number in RepriceSchedule.objects.values_list('tier').annotate(number=Count('id')))
+
+    return max(1, demand / constants.reprice_hourly_budget)
+
+
+def get_due_schedules(now: datetime) -> list:
+    """
+    Get due pairs schedules within the scheduler run budget, the most frequent tiers and the most
+    overdue pairs are the first
+
+    :return: list of tuples: (schedule id, tier, ASIN)
+    """
+
+    limit = int(constants.reprice_hourly_budget * constants.reprice_scheduler_interval / 3600)
+
+    return list(RepriceSchedule.objects.filter(next_run__lte=now).order_by('tier', 'next_run').values_list(
+        'id', 'tier', 'pair__asin')[:limit])
+
+
+def schedule_next_runs(schedules: list, now: datetime) -> None:
+    """ Schedule next runs of repriced pairs by their tiers intervals, schedules format: [(id, tier), ...] """
+
+    factor = get_intervals_factor()
+
+    for tier, _ in RepriceSchedule.tiers:
+        RepriceSchedule.objects.filter(id__in=[schedule_id for schedule_id, schedule_tier in schedules
+                                               if schedule_tier == tier]).update(
+            next_run=now + timedelta(seconds=constants.reprice_tier_intervals[tier] * factor)
+        )
@@ -0,0 +1,103 @@
+import numpy as np
+
+from os import makedirs, path as os_path
+from time import perf_counter
+
+from .strategies import BUYBOX_NONE, BUYBOX_WON, RepricingStrategy
+
+
+class PriceHistory(object):
+    """
+    Recorded market history of items for offline repricing
+
+    History is a directory of .npy arrays. Snapshot arrays have (snapshots x items) shape and are
+    memory-mapped, so only one snapshot row is in memory at once:
+        prices.npy - competitor buybox or lowest prices, 0 if unknown
+        buybox.npy - recorded buybox statuses codes
+    Item arrays have (items) shape:
+        minimum_prices.npy, approximate_prices.npy, current_prices.npy
+    """
+
+    snapshot_arrays = 'prices', 'buybox'
+    item_arrays = 'minimum_prices', 'approximate_prices', 'current_prices'
+
+    def __init__(self, directory: str):
+        for name in self.snapshot_arrays + self.item_arrays:
+            setattr(self, name, np.load(os_path.join(directory, name + '.npy'), mmap_mode='r'))
+
+        if self.prices.shape != self.buybox.shape or self.prices.shape[1:] != self.current_prices.shape:
+            raise ValueError('History arrays shapes do not match')
+
+    def __len__(self):
+        return self.prices.shape[0]
+
+    @property
+    def items_number(self) -> int:
+        return self.prices.shape[1]
+
+    @classmethod
+    def create(cls, directory: str, snapshots: int, items: int) -> dict:
+        """ Create empty history files, return dictionary of writable memory-mapped arrays by names """
+
+        makedirs(directory, exist_ok=True)
+        arrays = {}
+
+        for name in cls.snapshot_arrays + cls.item_arrays:
+            arrays[name] = np.lib.format.open_memmap(
+                os_path.join(directory, name + '.npy'), mode='w+',
+                dtype=np.int8 if name == 'buybox' else np.float64,
+                shape=(snapshots, items) if name in cls.snapshot_arrays else (items,)
+            )
+
+        return arrays
+
+
+def simulate(history: PriceHistory, strategy: RepricingStrategy) -> dict:
+    """
+    Replay price history through the repricing strategy
+
+    The first snapshot uses recorded buybox statuses. After that buybox is won when our price is not higher
+    than the recorded competitor price, items without buybox in the record stay without buybox.
+    Margin is the average difference between our and minimum prices over won items snapshots.
+
+    :return: dictionary of results: buybox share, margin, price changes and feed messages numbers, time
+    """
+
+    start = perf_counter()
+    minimum_prices = np.array(history.minimum_prices, dtype=float)
+    approximate_prices = np.array(history.approximate_prices, dtype=float)
+    current_prices = np.array(history.current_prices, dtype=float)
+    old_buybox_prices = np.zeros(history.items_number)
+    winners = np.asarray(history.buybox[0]) == BUYBOX_WON
+    offers, won, margin, price_changes, feed_messages = 0, 0, 0.0, 0, 0
+
+    for snapshot in range(len(history)):
+        prices = np.array(history.prices[snapshot], dtype=float)
+        buybox = np.array(history.buybox[snapshot], dtype=np.int8)
+
+        if snapshot:
+            buybox = np.where(buybox == BUYBOX_NONE, buybox, (current_prices <= prices).astype(np.int8))
+
+        is_won = buybox == BUYBOX_WON
+        offers += int(np.count_nonzero(buybox != BUYBOX_NONE))
+        won += int(np.count_nonzero(is_won))
+        margin += float((current_prices - minimum_prices)[is_won].sum())
+
+        new_prices, sent, winners, old_buybox_prices = strategy.reprice(
+            prices, buybox, minimum_prices, approximate_prices, current_prices, old_buybox_prices, winners
+        )
+
+        price_changes += int(np.count_nonzero(new_prices != current_prices))
+        feed_messages += int(np.count_nonzero(sent))
+        current_prices = new_prices
+
+    return {
+        'strategy': strategy.__class__.__name__,
+        'snapshots': len(history),
+        'items': history.items_number,
+        'buybox_share': round(won / offers, 4) if offers else None,
+        'margin': round(margin / won, 4) if won else None,
+        'price_changes': price_changes,
+        'feed_messages': feed_messages,
+        'time': round(perf_counter() - start, 2)
+    }
@@ -0,0 +1,145 @@
+import numpy as np
+
+from abc import ABC, abstractmethod
+
+from pairs.profit import profit_engine
+
+# buybox statuses codes of price info arrays
+
+BUYBOX_NONE = -1
+BUYBOX_LOST = 0
+BUYBOX_WON = 1
+
+price_step = 0.01
+
+
+class RepricingStrategy(ABC):
+    """
+    Base repricing strategy, all items are repriced at once
+
+    Strategy gets columnar arrays of items market and pair data and returns arrays of new pairs values.
+    New strategies implement abstract `choose` method and are registered in the `strategies` dictionary.
+    """
+
+    @staticmethod
+    def buybox_codes(buybox_statuses: list) -> np.ndarray:
+        """ Convert list of buybox statuses (None, False, True) into array of codes """
+
+        return np.array([BUYBOX_NONE if status is None else int(bool(status)) for status in buybox_statuses],
+                        dtype=np.int8)
+
+    @abstractmethod
+    def choose(self, prices: np.ndarray, minimum_granted: np.ndarray, buybox: np.ndarray,
+               minimum_prices: np.ndarray, current_prices: np.ndarray, old_buybox_prices: np.ndarray,
+               winners: np.ndarray) -> tuple:
+        """
+        Choose new prices for guarded competitor prices
+
+        :return: tuple of arrays: (new prices, is price sent to Amazon, is current price updated,
+            new old buybox prices)
+        """
+
+    @staticmethod
+    def changed_state(result: tuple, current_prices, old_buybox_prices, winners) -> np.ndarray:
+        """
+        Get mask of items whose state is changed by the strategy: current price, buybox winner flag or
+        old buybox price, result is the tuple returned by `reprice` for the given state. Other items
+        only get the same state and resend their current prices
+        """
+
+        new_prices, _, new_winners, new_old_buybox_prices = result
+
+        return ((new_prices != np.asarray(current_prices, dtype=float)) |
+                (new_winners != np.asarray(winners, dtype=bool)) |
+                (new_old_buybox_prices != np.asarray(old_buybox_prices, dtype=float)))
+
+    def reprice(self, prices, buybox, minimum_prices, approximate_prices, current_prices, old_buybox_prices,
+                winners) -> tuple:
+        """
+        Reprice items
+
+        :param prices: array of competitor prices, 0 if unknown
+        :param buybox: array of buybox statuses codes
+        :param minimum_prices: array of pairs Amazon minimum prices
+        :param approximate_prices: array of pairs Amazon approximate prices
+        :param current_prices: array of pairs Amazon current prices
+        :param old_buybox_prices: array of pairs old buybox prices
+        :param winners: array of pairs previous buybox winner flags
+        :return: tuple of arrays: (new current prices, is price sent to Amazon, buybox winner flags,
+            new old buybox prices)
+        """
+
+        buybox = np.asarray(buybox, dtype=np.int8)
+        minimum_prices = np.asarray(minimum_prices, dtype=float)
+        current_prices = np.asarray(current_prices, dtype=float)
+        old_buybox_prices = np.asarray(old_buybox_prices, dtype=float)
+        winners = np.asarray(winners, dtype=bool)
+
+        # change price if too low
+
+        prices, minimum_granted = profit_engine.guard_prices(prices, minimum_prices, approximate_prices)
+        new_prices, sent, updated, old_buybox_prices = self.choose(
+            prices, minimum_granted, buybox, minimum_prices, current_prices, old_buybox_prices, winners
+        )
+
+        # items without updates keep their current prices, buybox winner flag is False for no-buybox items
+
+        new_prices = np.where(updated, new_prices, current_prices)
+        return new_prices, sent, buybox == BUYBOX_WON, old_buybox_prices
+
+
+class PriceChangeStrategy(RepricingStrategy):
+    """ Undercut competitor price only when it differs from the current price """
+
+    def choose(self, prices, minimum_granted, buybox, minimum_prices, current_prices, old_buybox_prices, winners):
+        lost = buybox == BUYBOX_LOST
+        changed = (prices != current_prices) & ~minimum_granted
+
+        # if no BuyBox winner now and earlier, or no BuyBox at all, changed prices are undercut
+
+        undercut = ((buybox == BUYBOX_NONE) | (lost & ~winners)) & changed
+
+        # if no BuyBox winner, but BuyBox winner earlier, price is undercut when it is not higher than current one,
+        # minimum price is set without undercut
+
+        dropped = lost & winners & (prices <= current_prices)
+        undercut |= dropped & ~minimum_granted
+
+        return np.where(undercut, prices - price_step, prices), undercut, undercut | dropped, old_buybox_prices
+
+
+class BuyboxChaseStrategy(RepricingStrategy):
+    """ Undercut competitor price every run, repeated competitor price is chased from the current price """
+
+    def choose(self, prices, minimum_granted, buybox, minimum_prices, current_prices, old_buybox_prices, winners):
+        lost = buybox == BUYBOX_LOST
+        new_prices = prices - price_step
+
+        # if no BuyBox, price is undercut
+
+        undercut = (buybox == BUYBOX_NONE) & ~minimum_granted
+
+        # if no BuyBox winner, but BuyBox winner earlier, price is undercut when it is not higher than current one,
+        # minimum price is set without undercut
+
+        dropped = lost & winners & (prices <= current_prices)
+        undercut |= dropped & ~minimum_granted
+
+        # if no BuyBox winner earlier, new competitor price is stored and undercut,
+        # the same competitor price is undercut from the current price while it is above minimum price
+
+        chased = lost & ~winners & ~minimum_granted
+        new_competitor = chased & (prices != old_buybox_prices)
+        lowered = chased & ~new_competitor & (current_prices - price_step >= minimum_prices)
+
+        new_prices = np.where(chased & ~new_competitor, np.where(lowered, current_prices - price_step, prices),
+                              new_prices)
+        old_buybox_prices = np.where(new_competitor, prices, old_buybox_prices)
+        sent = undercut | chased
+        return np.where(sent, new_prices, prices), sent, sent | dropped, old_buybox_prices
+
+
+strategies = {
+    0: PriceChangeStrategy(),
+    1: BuyboxChaseStrategy()
+}
@@ -1,15 +1,22 @@
 from celery import shared_task
 from celery.utils.log import get_task_logger
 from django.utils.timezone import get_current_timezone
+from django.db import transaction
 
 from datetime import datetime, timedelta
+from time import time
+
+import numpy as np
 
 from config import constants
 from pairs.parsers import get_my_price_from_response
 from pairs.tasks import set_prices, set_prices_local
 from pairs.helpers import get_item_price_info
-from utils import amazon_products_api
+from utils import amazon_products_api, delete_in_chunks
+from .history import compact_snapshots, get_last_snapshots, record_snapshots
 from .models import RepricerStats
+from .scheduler import get_due_schedules, schedule_next_runs, update_tiers
+from .strategies import RepricingStrategy, strategies
 
 logger = get_task_logger(__name__)
 
@@ -17,171 +24,214 @@ logger = get_task_logger(__name__)
 def calc_current_prices():
     """ Set items inventory prices from Amazon """
 
-    prices = []
+    prices = {}
     from pairs.models import Pair
     asins = [pair.asin for pair in Pair.objects.exclude(seller_sku='')]
 
     for asin in asins:
         response = amazon_products_api.api.get_my_price_for_asin(amazon_products_api.region, [asin])
-        prices.append((asin, get_my_price_from_response(response)[0]))
+        prices[asin] = get_my_price_from_response(response)[0]
 
     set_prices_local(prices, for_current_price=True)
 
 
-@shared_task(name='Repricer')
-def reprice(strategy=1):
-    """ Create reprice configuration for in-inventory items and submit it """
+class PairsChanges(object):
+    """ In-memory pairs field changes, flushed by one bulk_update per changed fields set """
 
-    from pairs.models import Pair
-    asins = [pair.asin for pair in Pair.objects.filter(amazon_current_price__gt=0).exclude(seller_sku='')]
+    def __init__(self):
+        self._fields = {}
 
-    if not len(asins):
-        logger.warning('No items for repricing')
-        return
+    def __len__(self):
+        return len(self._fields)
 
-    prices = []
-    prices_info = get_item_price_info(asins, logger)
+    def set(self, pair, field, value):
+        """ Set pair field value and record the change if the value is new """
 
-    if prices_info is None:
-        logger.critical('Empty prices info list')
-        return
-
-    for asin_info in prices_info:
-        pair = Pair.objects.get(asin=asin_info[0])
-        price = asin_info[1]
-        buybox_status = asin_info[2]
+        if getattr(pair, field) != value:
+            setattr(pair, field, value)
+            self._fields.setdefault(pair, set()).add(field)
 
-        # change price if too low
+    def flush(self):
+        from pairs.models import Pair
 
-        minimum_price_granted = False
+        groups = {}
 
-        if not price:
-            price = pair.amazon_approximate_price
+        for pair, fields in self._fields.items():
+            groups.setdefault(tuple(sorted(fields)), []).append(pair)
 
-        elif price <= pair.amazon_minimum_price:
-            price = pair.amazon_minimum_price
-            minimum_price_granted = True
+        for fields, pairs in groups.items():
+            Pair.objects.bulk_update(pairs, fields, batch_size=constants.bulk_batch_size)
 
-        # first strategy
+        self._fields = {}
 
-        if not strategy:
-            # actions according to the BuyBox status
 
-            if buybox_status is None:
-                # if no BuyBox
+@shared_task(name='Repricer')
+def reprice(strategy=1, full=False, asins=None):
+    """
+    Create reprice configuration for in-inventory items and submit it
 
-                if price != pair.amazon_current_price and not minimum_price_granted:
-                    price -= 0.01
-                    prices.append((pair.asin, price))
+    Items with the same competitor price, buybox status and our price as in their last price snapshot
+    are skipped, unless the strategy would change their state or full run is requested
 
-                else:
-                    pair.set_buybox_status(False)
-                    continue
+    :param asins: list of ASINs to reprice, all in-inventory items by default
+    :return: list of ASINs with received price info and accepted prices, None if price info was not received
+    """
 
-            elif buybox_status:
-                # if BuyBox winner
+    from pairs.models import Pair
 
-                pair.set_buybox_status(buybox_status)
-                continue
+    times = {}
+    start = time()
+    pairs = Pair.objects.filter(amazon_current_price__gt=0).exclude(seller_sku='')
 
-            else:
-                # if no BuyBox winner, but BuyBox winner earlier
+    if asins is not None:
+        pairs = pairs.filter(asin__in=asins)
 
-                if pair.is_buybox_winner and price <= pair.amazon_current_price and not minimum_price_granted:
-                    price -= 0.01
-                    prices.append((pair.asin, price))
+    pairs = {pair.asin: pair for pair in pairs}
+    times['load'] = time() - start
 
-                elif pair.is_buybox_winner and price > pair.amazon_current_price:
-                    pair.set_buybox_status(buybox_status)
-                    continue
+    if not len(pairs):
+        logger.warning('No items for repricing')
+        return []
 
-                elif not pair.is_buybox_winner:
-                    # if no BuyBox winner earlier
+    start = time()
+    prices = {}
+    changes = PairsChanges()
 
-                    if price != pair.amazon_current_price and not minimum_price_granted:
-                        price -= 0.01
-                        prices.append((pair.asin, price))
+    # cached prices may be older than the last run snapshots, the repricer always requests fresh ones
 
-                    else:
-                        pair.set_buybox_status(buybox_status)
-                        continue
+    prices_info = get_item_price_info(list(pairs.keys()), logger, cache=None)
+    times['fetch'] = time() - start
 
-        # second strategy with another price reduction
+    if prices_info is None:
+        logger.critical('Empty prices info list')
+        return
 
-        elif strategy == 1:
-            # actions according to the BuyBox status
+    start = time()
+    pairs = [pairs[asin_info[0]] for asin_info in prices_info]
+    total = len(pairs)
+    fetched = [pair.asin for pair in pairs]
+
+    current_prices = [pair.amazon_current_price for pair in pairs]
+    old_buybox_prices = [pair.old_buybox_price for pair in pairs]
+    winners = [pair.is_buybox_winner for pair in pairs]
+
+    result = strategies[strategy].reprice(
+        [asin_info[1] for asin_info in prices_info],
+        RepricingStrategy.buybox_codes([asin_info[2] for asin_info in prices_info]),
+        [pair.amazon_minimum_price for pair in pairs],
+        [pair.amazon_approximate_price for pair in pairs],
+        current_prices, old_buybox_prices, winners
+    )
+
+    if not full:
+        last_snapshots = get_last_snapshots([pair.id for pair in pairs], constants.reprice_unchanged_days)
+        unchanged = np.array([
+            pair.id in last_snapshots and
+            (last_snapshots[pair.id].price, last_snapshots[pair.id].is_buybox_winner,
+             last_snapshots[pair.id].our_price) == (asin_info[1], asin_info[2], pair.amazon_current_price)
+            for pair, asin_info in zip(pairs, prices_info)
+        ], dtype=bool)
+
+        repriced = ~unchanged | RepricingStrategy.changed_state(result, current_prices, old_buybox_prices, winners)
+        indexes = np.flatnonzero(repriced).tolist()
+        pairs = [pairs[index] for index in indexes]
+        prices_info = [prices_info[index] for index in indexes]
+        result = tuple(array[repriced] for array in result)
+
+    new_prices, sent, winners, old_buybox_prices = result
+
+    for pair, price, is_sent in zip(pairs, new_prices.tolist(), sent.tolist()):
+        if is_sent:
+            prices[pair.asin] = price
+
+    times['strategy'] = time() - start
+
+    # prices are submitted before writing, pairs of not accepted chunks keep their state and get no snapshots,
+    # so the next run does not skip them as unchanged
+
+    start = time()
+    failed_skus = set()
+
+    if len(prices):
+        _, failed_skus = set_prices(prices)
+        logger.info('Reprice configuration set, prices: {0}, not accepted: {1}'.format(len(prices),
+                                                                                      len(failed_skus)))
+
+    else:
+        logger.info('Empty reprice configuration')
 
-            if buybox_status is None:
-                # if no BuyBox
+    times['submit'] = time() - start
+    start = time()
+    rejected = {pair.asin for pair in pairs if pair.seller_sku in failed_skus}
+    rows = [row for row in zip(pairs, prices_info, new_prices.tolist(), winners.tolist(), old_buybox_prices.tolist())
+            if row[0].asin not in rejected]
 
-                if not minimum_price_granted:
-                    price -= 0.01
-                    prices.append((pair.asin, price))
+    for pair, _, price, is_winner, old_buybox_price in rows:
+        changes.set(pair, 'is_buybox_winner', is_winner)
+        changes.set(pair, 'old_buybox_price', old_buybox_price)
+        changes.set(pair, 'amazon_current_price', price)
 
-                else:
-                    pair.set_buybox_status(False)
-                    continue
+    changed = len(changes)
 
-            elif buybox_status:
-                # if BuyBox winner
+    with transaction.atomic():
+        changes.flush()
 
-                pair.set_buybox_status(buybox_status)
-                continue
+    record_snapshots([row[0] for row in rows], [row[1][1] for row in rows], [row[1][2] for row in rows],
+                     [row[2] for row in rows])
 
-            else:
-                # if no BuyBox winner, but BuyBox winner earlier
+    RepricerStats(repriced_count=len(rows), skipped_count=total - len(pairs)).save_stats()
+    times['write'] = time() - start
 
-                if pair.is_buybox_winner and price <= pair.amazon_current_price and not minimum_price_granted:
-                    price -= 0.01
-                    prices.append((pair.asin, price))
+    logger.info('Repricer stats saved, items: {0}, repriced: {1}, skipped: {2}, changed: {3}, phases time: {4}'
+                .format(total, len(rows), total - len(pairs), changed,
+                        ', '.join('{0}: {1:.2f} s'.format(phase, times[phase]) for phase in times)))
 
-                elif pair.is_buybox_winner and price > pair.amazon_current_price:
-                    pair.set_buybox_status(buybox_status)
-                    continue
+    return [asin for asin in fetched if asin not in rejected]
 
-                elif not pair.is_buybox_winner:
-                    # if no BuyBox winner earlier
 
-                    if not minimum_price_granted:
-                        if price != pair.old_buybox_price:
-                            pair.old_buybox_price = price
-                            pair.save(update_fields=['old_buybox_price'])
-                            price -= 0.01
+@shared_task(name='Scheduled repricer')
+def scheduled_reprice(strategy=1):
+    """
+    Reprice due items of all tiers within the hourly ASINs budget, next runs are scheduled
+    after the repricing completes, items without received price info stay due
+    """
 
-                        elif pair.amazon_current_price - 0.01 >= pair.amazon_minimum_price:
-                            price = pair.amazon_current_price - 0.01
+    now = datetime.now(get_current_timezone())
+    due = get_due_schedules(now)
 
-                        prices.append((pair.asin, price))
+    if not len(due):
+        logger.info('No scheduled items for repricing')
+        return
 
-                    else:
-                        pair.set_buybox_status(buybox_status)
-                        continue
+    fetched = reprice(strategy, asins=[asin for _, _, asin in due])
 
-        if buybox_status is None:
-            pair.set_buybox_status(False)
-        else:
-            pair.set_buybox_status(buybox_status)
+    if fetched is None:
+        logger.warning('Scheduled items stay due, price info was not received')
+        return
 
-        pair.amazon_current_price = price
-        pair.save(update_fields=['amazon_current_price'])
+    fetched = set(fetched)
+    schedule_next_runs([(schedule_id, tier) for schedule_id, tier, asin in due if asin in fetched], now)
 
-    RepricerStats().save_stats()
-    logger.info('Repricer stats saved')
 
-    if not len(prices):
-        logger.info('Empty reprice configuration')
-        return
+@shared_task(name='Assign reprice tiers')
+def assign_reprice_tiers():
+    """ Assign repricing tiers to items by their orders, buybox churn and price volatility """
 
-    set_prices(prices)
-    logger.info('Reprice configuration set')
+    logger.info('Reprice tiers assigned: {0}'.format(', '.join(
+        '{0}: {1}'.format(name, number) for name, number in update_tiers().items()
+    )))
 
 
 @shared_task(name='Delete old repricer info')
 def delete_old_repricer_info():
     """ Delete old repricer statistics info """
 
-    for stats in RepricerStats.objects.filter(created__lte=datetime.now(get_current_timezone()) - timedelta(
-           days=constants.old_stats_days_live)):
-        stats.delete()
+    delete_in_chunks(RepricerStats.objects.filter(created__lte=datetime.now(get_current_timezone()) - timedelta(
+        days=constants.old_stats_days_live)), 'old repricer stats', logger)
+
+
+@shared_task(name='Compact price history')
+def compact_price_history():
+    """ Downsample old price snapshots and delete expired ones """
 
-    logger.info('Old reprice info deleted')
+    compact_snapshots(logger)
@@ -0,0 +1,29 @@
+from django.test import TestCase
+from django.utils.timezone import get_current_timezone
+
+from datetime import datetime, timedelta
+
+from ..history import get_downsampled_snapshots
+from ..models import PriceSnapshot
+
+
+class DownsampledSnapshotsTest(TestCase):
+    """ Test selection of snapshots removed by downsampling """
+
+    def setUp(self) -> None:
+        self.hour = datetime(2020, 1, 1, 10, tzinfo=get_current_timezone())
+
+        for pair_id, minutes in ((1, 5), (1, 20), (1, 50), (1, 70), (2, 30)):
+            snapshot = PriceSnapshot.objects.create(pair_id=pair_id, price=10, is_buybox_winner=None, our_price=10)
+            PriceSnapshot.objects.filter(id=snapshot.id).update(created=self.hour + timedelta(minutes=minutes))
+
+    def test_query(self):
+        self.assertIn('EXISTS', str(get_downsampled_snapshots(self.hour, self.hour + timedelta(days=1)).query))
+
+    def test_last_snapshot_in_hour_is_kept(self):
+        queryset = get_downsampled_snapshots(self.hour, self.hour + timedelta(days=1))
+        removed = sorted(queryset.values_list('created', flat=True))
+        self.assertEqual(removed, [self.hour + timedelta(minutes=5), self.hour + timedelta(minutes=20)])
+
+        queryset.filter(pk__gte=0).delete()
+        self.assertEqual(PriceSnapshot.objects.count(), 3)
@@ -0,0 +1,75 @@
+from django.test import TestCase
+
+import numpy as np
+
+from ..strategies import BUYBOX_LOST, BUYBOX_NONE, BUYBOX_WON, strategies
+
+
+class RepricingStrategiesTest(TestCase):
+    """ Test repricing strategies results """
+
+    # items: no buybox, won buybox, lost buybox earlier won, lost buybox with the same competitor price,
+    # lost buybox with minimum price granted
+
+    prices = [15, 15, 12, 15, 5]
+    buybox = [BUYBOX_NONE, BUYBOX_WON, BUYBOX_LOST, BUYBOX_LOST, BUYBOX_LOST]
+    minimum_prices = [10, 10, 10, 10, 10]
+    approximate_prices = [20, 20, 20, 20, 20]
+    current_prices = [15, 14, 14, 14, 14]
+    old_buybox_prices = [0, 0, 0, 15, 0]
+    winners = [False, True, True, False, False]
+
+    def reprice(self, strategy: int) -> tuple:
+        return strategies[strategy].reprice(
+            self.prices, self.buybox, self.minimum_prices, self.approximate_prices, self.current_prices,
+            self.old_buybox_prices, self.winners
+        )
+
+    def test_price_change_strategy(self):
+        prices, sent, winners, old_buybox_prices = self.reprice(0)
+
+        self.assertEqual(list(sent), [False, False, True, True, False])
+        self.assertEqual(list(prices), [15, 14, 12 - 0.01, 15 - 0.01, 14])
+        self.assertEqual(list(winners), [False, True, False, False, False])
+        self.assertEqual(list(old_buybox_prices), self.old_buybox_prices)
+
+    def test_buybox_chase_strategy(self):
+        prices, sent, winners, old_buybox_prices = self.reprice(1)
+
+        self.assertEqual(list(sent), [True, False, True, True, False])
+        self.assertEqual(list(prices), [15 - 0.01, 14, 12 - 0.01, 14 - 0.01, 14])
+        self.assertEqual(list(winners), [False, True, False, False, False])
+        self.assertEqual(list(old_buybox_prices), self.old_buybox_prices)
+
+    def test_lost_buybox_changes_state(self):
+        # buybox was won earlier and is lost now to the higher competitor price
+
+        for strategy in strategies.values():
+            result = strategy.reprice([15], [BUYBOX_LOST], [10], [20], [14], [0], [True])
+            self.assertEqual(list(strategy.changed_state(result, [14], [0], [True])), [True])
+
+    def test_skipped_items_keep_state(self):
+        random = np.random.RandomState(0)
+        size = 10000
+        prices = random.choice([0, 5, 10, 12, 14, 15], size)
+        buybox = random.choice([BUYBOX_NONE, BUYBOX_LOST, BUYBOX_WON], size)
+        minimum_prices = random.choice([5, 10, 12], size)
+        approximate_prices = minimum_prices + 5
+
+        for strategy in strategies.values():
+            # the second run gets the same market as the first one and state after it
+
+            current_prices, _, winners, old_buybox_prices = strategy.reprice(
+                prices, buybox, minimum_prices, approximate_prices, random.choice([10, 12, 14, 15], size),
+                random.choice([0, 12, 15], size), random.choice([False, True], size)
+            )
+
+            result = strategy.reprice(prices, buybox, minimum_prices, approximate_prices, current_prices,
+                                      old_buybox_prices, winners)
+            skipped = ~strategy.changed_state(result, current_prices, old_buybox_prices, winners)
+            new_prices, _, new_winners, new_old_buybox_prices = result
+
+            self.assertTrue(skipped.any())
+            self.assertTrue((new_prices[skipped] == current_prices[skipped]).all())
+            self.assertTrue((new_winners[skipped] == winners[skipped]).all())
+            self.assertTrue((new_old_buybox_prices[skipped] == old_buybox_prices[skipped]).all())
@@ -1,3 +1,5 @@
+import logging
+
 from ebaysdk.trading import Connection as Trading
 from ebaysdk.shopping import Connection as Shopping
 from ebaysdk.finding import Connection as Finding
@@ -6,13 +8,23 @@ from mws import Products, Orders, Feeds, MWSError
 from django.core.exceptions import ImproperlyConfigured
 
 from xml.etree import ElementTree
+from contextlib import contextmanager
 from copy import deepcopy
-from datetime import datetime, timedelta
-from time import sleep
+from datetime import datetime
+from calendar import timegm
+from math import inf
+from random import uniform
+from threading import Lock, local
+from time import sleep, time
 from json import loads
+from os import getpid
+from sqlite3 import connect
 
 from config import constants
 
+logger = logging.getLogger('custom')
+api_context = local()
+
 
 def get_secret(filename):
     """ Get the secret from json file or raise exception """
@@ -37,52 +49,405 @@ def get_secret(filename):
         raise ImproperlyConfigured('Add the {0} field to json secret'.format(k))
 
 
-class ApiCallsChecker(object):
-    """ Class for check and update ability to make api requests with limits per time period """
+@contextmanager
+def api_priority(priority, timeout=None):
+    """
+    Set quota priority class and max quota waiting time in seconds for Amazon api calls
+    made in the current thread inside the block
+    """
+
+    previous = getattr(api_context, 'priority', None)
+    api_context.priority = priority, timeout
+
+    try:
+        yield
+
+    finally:
+        api_context.priority = previous
+
+
+def get_api_priority():
+    """ Get (priority class, quota timeout) of the current thread, ('normal', None) by default """
+
+    return getattr(api_context, 'priority', None) or ('normal', None)
+
+
+def delete_in_chunks(queryset, name, log=logger, chunk_size=None):
+    """
+    Delete queryset rows in primary key ranges, every range is deleted in a separate short transaction,
+    so big deletes do not lock the table for long
+
+    :param queryset: queryset of rows to delete
+    :param name: rows name for logging
+    :param log: logger for deletion stats
+    :param chunk_size: primary key range size
+    :return: number of deleted rows
+    """
+
+    from django.db import transaction
+    from django.db.models import Min, Max
+
+    chunk_size = constants.delete_chunk_size if chunk_size is None else chunk_size
+    bounds = queryset.aggregate(first=Min('pk'), last=Max('pk'))
+    deleted, start = 0, time()
+
+    if bounds['first'] is None:
+        log.info('No {0} to delete'.format(name))
+        return 0
+
+    for chunk_start in range(bounds['first'], bounds['last'] + 1, chunk_size):
+        with transaction.atomic():
+            _, rows = queryset.filter(pk__gte=chunk_start, pk__lt=chunk_start + chunk_size).delete()
+
+        deleted += rows.get(queryset.model._meta.label, 0)
+
+    duration = time() - start
+
+    log.info('Deleted {0}: {1}, time: {2:.1f} s, {3:.0f} rows/s'.format(
+        name, deleted, duration, deleted / duration if duration else deleted
+    ))
+
+    return deleted
+
+
+class QuotaLimiter(object):
+    """
+    Cross-process sliding-window limiter for api operations
+
+    Calls are stored in a local sqlite database file, the database write lock serializes
+    limit checks between all processes (web, default, workflow and repricer workers),
+    so they share one api budget. Limits format:
+        {service: {operation: ((max calls, window in seconds), ...)}}
+    """
+
+    def __init__(self, filename, limits, priorities=None):
+        """
+        :param filename: sqlite database file path
+        :param limits: dictionary with sliding-window limits per api and operation
+        :param priorities: dictionary with share of every limit available for the priority class
+        """
+
+        self.__filename = str(filename)
+        self.__limits = limits
+        self.__priorities = constants.api_priorities if priorities is None else priorities
+        self.__local = local()
+
+    def __connection(self):
+        """ Get sqlite connection for the current thread and process """
+
+        connection = getattr(self.__local, 'connection', None)
+
+        if connection is None or self.__local.pid != getpid():
+            connection = connect(self.__filename, timeout=constants.quota_db_timeout, isolation_level=None)
+            connection.execute('CREATE TABLE IF NOT EXISTS calls (key TEXT, created REAL, cost INTEGER)')
+            connection.execute('CREATE INDEX IF NOT EXISTS calls_key_created ON calls (key, created)')
+
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS metrics (key TEXT, priority TEXT, acquired INTEGER, waited INTEGER, '
+                'rejected INTEGER, wait_time REAL, PRIMARY KEY (key, priority))'
+            )
+
+            self.__local.connection = connection
+            self.__local.pid = getpid()
+
+        return connection
+
+    def __try_acquire(self, key, limits, cost, share):
+        """ Register the call if all limits allow it, otherwise return seconds to wait """
 
-    def __init__(self, service):
-        self.__status = True
-        self.__start_time = datetime.now()
+        connection = self.__connection()
+        now = time()
+        wait = 0
+
+        connection.execute('BEGIN IMMEDIATE')
+
+        try:
+            connection.execute('DELETE FROM calls WHERE key = ? AND created < ?',
+                               (key, now - max(window for _, window in limits)))
+
+            for limit, window in limits:
+                allowed = max(1, int(limit * share))
+                used = connection.execute('SELECT COALESCE(SUM(cost), 0) FROM calls WHERE key = ? AND created >= ?',
+                                          (key, now - window)).fetchone()[0]
+
+                excess = used + min(cost, allowed) - allowed
+
+                if excess <= 0:
+                    continue
+
+                # wait until enough old calls leave the window, calls are scanned only for exceeded limits
+
+                for created, call_cost in connection.execute('SELECT created, cost FROM calls WHERE key = ? AND '
+                                                             'created >= ? ORDER BY created', (key, now - window)):
+                    excess -= call_cost
+                    wait = max(wait, created + window - now)
+
+                    if excess <= 0:
+                        break
+
+            if not wait:
+                connection.execute('INSERT INTO calls VALUES (?, ?, ?)', (key, now, cost))
+
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+        connection.execute('COMMIT')
+        return wait
+
+    def __update_metrics(self, key, priority, acquired=0, waited=0, rejected=0, wait_time=0):
+        self.__connection().execute(
+            'INSERT INTO metrics VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (key, priority) DO UPDATE SET '
+            'acquired = acquired + excluded.acquired, waited = waited + excluded.waited, '
+            'rejected = rejected + excluded.rejected, wait_time = wait_time + excluded.wait_time',
+            (key, priority, acquired, waited, rejected, wait_time)
+        )
+
+    def acquire(self, service, operation, cost=1, priority='normal', block=True, timeout=None):
+        """
+        Acquire api call permission
+
+        :param service: api service name, like 'amazon-products'
+        :param operation: api operation name, like 'GetCompetitivePricingForASIN'
+        :param cost: number of items in the call
+        :param priority: priority class, lower classes can use only a part of the limits
+        :param block: wait until the call is allowed or return False immediately
+        :param timeout: max waiting time in seconds
+        :return: True if the call is allowed
+        """
+
+        try:
+            limits = self.__limits[service][operation]
+
+        except KeyError:
+            return True
+
+        try:
+            share = self.__priorities[priority]
+
+        except KeyError:
+            raise ValueError('Wrong priority class: {0}'.format(priority))
+
+        key = '{0}:{1}'.format(service, operation)
+        start = time()
+        waited = False
+
+        while True:
+            wait = self.__try_acquire(key, limits, cost, share)
+
+            if not wait:
+                self.__update_metrics(key, priority, acquired=1, waited=int(waited), wait_time=time() - start)
+                return True
+
+            if not block or (timeout is not None and time() - start + wait > timeout):
+                self.__update_metrics(key, priority, rejected=1)
+                return False
+
+            waited = True
+            sleep(min(wait, constants.quota_max_sleep))
+
+    def usage(self):
+        """
+        Get api usage metrics in format:
+            {service:operation: {'windows': [(used, limit, window), ...], priority: {metric: value}}}
+        """
+
+        connection = self.__connection()
+        now = time()
+        result = {}
+
+        for service in self.__limits:
+            for operation, limits in self.__limits[service].items():
+                key = '{0}:{1}'.format(service, operation)
+                result[key] = {'windows': []}
+
+                for limit, window in limits:
+                    used = connection.execute('SELECT COALESCE(SUM(cost), 0) FROM calls WHERE key = ? AND created >= ?',
+                                              (key, now - window)).fetchone()[0]
+                    result[key]['windows'].append((used, limit, window))
+
+        for key, priority, acquired, waited, rejected, wait_time in connection.execute('SELECT * FROM metrics'):
+            result.setdefault(key, {'windows': []})[priority] = {
+                'acquired': acquired, 'waited': waited, 'rejected': rejected, 'wait_time': round(wait_time, 2)
+            }
+
+        return result
+
+
+class ThrottledApi(object):
+    """
+    Throttle-aware wrapper of mws api client
+
+    Every api method call acquires the shared quota with the priority set by api_priority, waits
+    proactively when the quota headers (x-mws-quota-remaining, x-mws-quota-resetsOn) show that
+    the hourly quota is over and retries throttled calls with exponential backoff.
+    Keeps per-operation metrics.
+    """
+
+    def __init__(self, api, service, tries=constants.mws_throttle_tries, delay=constants.mws_throttle_delay,
+                 max_delay=constants.mws_throttle_max_delay):
+        """
+        :param api: mws api client object
+        :param service: api service name, like 'amazon-products'
+        :param tries: number of tries for throttled call
+        :param delay: first delay after throttled call in seconds
+        :param max_delay: max delay after throttled call in seconds
+        """
+
+        self.__api = api
         self.__service = service
-        self.__counter = 0
+        self.__tries = tries
+        self.__delay = delay
+        self.__max_delay = max_delay
+        self.__quotas = {}
+        self.__metrics = {}
+        self.__lock = Lock()
 
-        if self.__service == 'ebay-trading':
-            self.__calls_limit = constants.ebay_trading_api_calls_number
+    def __getattr__(self, name):
+        attribute = getattr(self.__api, name)
 
-        elif self.__service == 'amazon-products':
-            self.__calls_limit = constants.amazon_product_api_calls_number
+        if name.startswith('_') or not callable(attribute):
+            return attribute
 
-        else:
-            self.__calls_limit = None
+        def method(*args, **kwargs):
+            return self.__call(attribute, self.get_operation(name, kwargs), args, kwargs)
 
-    def update_counter(self):
-        self.__counter += 1
+        return method
 
-        if self.__calls_limit is not None and self.__counter > self.__calls_limit:
-            self.__status = False
+    @staticmethod
+    def get_operation(name, kwargs):
+        """ Get MWS operation name by client method name, like list_order_items -> ListOrderItems """
 
-    def update_status(self):
-        self.__status = True
-        self.__start_time = datetime.now()
+        operation = ''.join(word.upper() if word in ('asin', 'sku') else word.capitalize() for word in name.split('_'))
 
-    @property
-    def status(self):
-        return self.__status
+        if kwargs.get('next_token') is not None:
+            operation += 'ByNextToken'
 
-    @property
-    def start_time(self):
-        if self.__service == 'ebay-trading':
-            return '{0}:{1}'.format(self.__start_time.hour, self.__start_time.minute)
+        return operation
+
+    def __get_cost(self, args, kwargs):
+        """ Products api quotas are counted in items, other api quotas in requests """
+
+        if self.__service != 'amazon-products':
+            return 1
+
+        return max([len(arg) for arg in list(args) + list(kwargs.values()) if isinstance(arg, (list, tuple))] or [1])
+
+    def __update_metrics(self, operation, **values):
+        with self.__lock:
+            metrics = self.__metrics.setdefault(operation, {
+                'calls': 0, 'errors': 0, 'throttled': 0, 'latency': 0.0, 'max_latency': 0.0, 'quota_wait': 0.0
+            })
+
+            for key, value in values.items():
+                if key == 'max_latency':
+                    metrics[key] = max(metrics[key], value)
+                else:
+                    metrics[key] += value
+
+    def __update_quota(self, operation, response):
+        """ Save hourly quota state from response headers """
+
+        headers = getattr(response, 'headers', None) or {}
+
+        try:
+            remaining = float(headers['x-mws-quota-remaining'])
+            resets_on = timegm(datetime.strptime(headers['x-mws-quota-resetsOn'], '%Y-%m-%dT%H:%M:%S.%fZ').timetuple())
+
+        except (KeyError, ValueError):
+            return
+
+        with self.__lock:
+            self.__quotas[operation] = remaining, resets_on
+
+    def __wait_for_quota(self, operation, cost):
+        """ Sleep until the hourly quota reset if the last known remaining quota is less than call cost """
 
-        elif self.__service == 'amazon-products':
-            return '{0}:{1}'.format((self.__start_time + timedelta(hours=1)).hour, self.__start_time.minute)
+        with self.__lock:
+            remaining, resets_on = self.__quotas.get(operation, (inf, 0))
+
+        delay = resets_on - time()
+
+        if remaining < cost and delay > 0:
+            logger.warning('MWS {0} quota is over, waiting {1:.1f} s.'.format(operation, delay))
+            self.__update_metrics(operation, quota_wait=delay)
+            sleep(delay)
+
+    @staticmethod
+    def is_throttled(error):
+        response = getattr(error, 'response', None)
+
+        if response is None:
+            return False
+
+        return response.status_code == 503 or any(code in response.text for code in constants.mws_throttle_codes)
+
+    def __call(self, method, operation, args, kwargs):
+        cost = self.__get_cost(args, kwargs)
+        attempt = 0
+
+        while True:
+            self.__wait_for_quota(operation, cost)
+            priority, timeout = get_api_priority()
+
+            if not quota_limiter.acquire(self.__service, operation, cost, priority, timeout=timeout):
+                raise MWSError('MWS {0} quota is not granted for {1} priority.'.format(operation, priority))
+
+            start = time()
+
+            try:
+                response = method(*args, **kwargs)
+
+            except MWSError as e:
+                latency = time() - start
+                self.__update_metrics(operation, calls=1, latency=latency, max_latency=latency)
+                self.__update_quota(operation, e.response)
+
+                if not self.is_throttled(e):
+                    self.__update_metrics(operation, errors=1)
+                    raise
+
+                self.__update_metrics(operation, throttled=1)
+                attempt += 1
+
+                if attempt >= self.__tries:
+                    logger.critical('MWS {0} is throttled after {1} tries.'.format(operation, attempt))
+                    raise
+
+                delay = min(self.__max_delay, self.__delay * 2 ** (attempt - 1))
+                sleep(delay + uniform(0, delay * constants.mws_throttle_jitter))
+
+            else:
+                latency = time() - start
+                self.__update_metrics(operation, calls=1, latency=latency, max_latency=latency)
+                self.__update_quota(operation, getattr(response, 'response', None))
+                return response
+
+    def stats(self):
+        """
+        Get per-operation metrics in format:
+            {operation: {'calls', 'errors', 'throttled', 'avg_latency', 'max_latency', 'quota_wait', 'remaining'}}
+        """
+
+        with self.__lock:
+            result = {}
+
+            for operation, metrics in self.__metrics.items():
+                result[operation] = dict(metrics, avg_latency=metrics['latency'] / max(metrics['calls'], 1))
+                result[operation]['remaining'] = self.__quotas.get(operation, (None,))[0]
+
+            return result
 
 
 class ApiObject(object):
-    """ Class that represents connection and calls limit checking for specified api """
+    """
+    Class that represents connection and calls limit checking for specified api,
+    Amazon api clients are wrapped by ThrottledApi
+    """
 
     def __init__(self, secret, service, tries=constants.con_tries, delay=constants.con_delay, country=None,
                  feed_types=None):
+        self.__service = service
         self.__tries = tries
         self.__init_tries = tries
         self.__delay = delay
@@ -90,8 +455,8 @@ class ApiObject(object):
         self.__feed_types = feed_types
         self.__connection_error = None
         self.__api = None
+        self.__get_connection = None
         self.connector(secret, service)
-        self.checker = None
 
     @property
     def api(self):
@@ -166,6 +531,8 @@ class ApiObject(object):
         else:
             raise ValueError('This api is not supported: {0}'.format(service))
 
+        self.__get_connection = get_connection
+
         while self.__tries:
             try:
                 api = get_connection()
@@ -179,22 +546,74 @@ class ApiObject(object):
 
             else:
                 self.__tries = self.__init_tries
-                self.__api = api
+                self.__api = self.wrap(api)
                 break
 
-    def check_calls(self, exception, func, *func_args, **func_kwargs):
-        if self.checker is None:
-            return True
+    def wrap(self, api):
+        return api if self.__service[:4] == 'ebay' else ThrottledApi(api, self.__service)
 
-        if not self.checker.status:
-            if exception:
-                raise func(*func_args, **func_kwargs)
-            else:
-                func(*func_args, **func_kwargs)
-                return False
+    def connect(self):
+        """ Create new api connection, api clients are not thread-safe, so every thread needs its own connection """
+
+        return self.wrap(self.__get_connection())
+
+    def acquire(self, operation, cost=1, priority='normal', block=True, timeout=None):
+        """ Acquire permission for the api operation call from the shared quota limiter """
+
+        return quota_limiter.acquire(self.__service, operation, cost, priority, block, timeout)
+
+
+class LazyObject(object):
+    """
+    Thread-safe proxy that creates the wrapped object by factory on first use,
+    so importing a module with singletons does not read files or connect to apis
+    """
 
-        self.checker.update_counter()
-        return True
+    __slots__ = ('_factory', '_wrapped', '_lock')
+
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_wrapped', None)
+        object.__setattr__(self, '_lock', Lock())
+
+    def _setup(self):
+        if self._wrapped is None:
+            with self._lock:
+                if self._wrapped is None:
+                    object.__setattr__(self, '_wrapped', self._factory())
+
+        return self._wrapped
+
+    @property
+    def is_initialized(self):
+        return self._wrapped is not None
+
+    def __getattr__(self, name):
+        return getattr(self._setup(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._setup(), name, value)
+
+    def __getitem__(self, key):
+        return self._setup()[key]
+
+    def __contains__(self, key):
+        return key in self._setup()
+
+    def __iter__(self):
+        return iter(self._setup())
+
+    def __len__(self):
+        return len(self._setup())
+
+    def __call__(self, *args, **kwargs):
+        return self._setup()(*args, **kwargs)
+
+    def __repr__(self):
+        if self._wrapped is None:
+            return '<LazyObject: not initialized>'
+
+        return '<LazyObject: {0!r}>'.format(self._wrapped)
 
 
 class XmlHelper(object):
@@ -267,22 +686,33 @@ class XmlHelper(object):
 
 
 # specific info
-secret_dict = get_secret(constants.secret_filename)
+secret_dict = LazyObject(lambda: get_secret(constants.secret_filename))
+
+# api calls limiter
+quota_limiter = LazyObject(lambda: QuotaLimiter(constants.quota_db_filename, constants.api_quota_limits))
 
 # apis
-ebay_trading_api = ApiObject(secret_dict, 'ebay-trading')
-ebay_shopping_api = ApiObject(secret_dict, 'ebay-shopping')
-amazon_products_api = ApiObject(secret_dict, 'amazon-products', country=constants.amazon_region)
-amazon_orders_api = ApiObject(secret_dict, 'amazon-orders', country=constants.amazon_region)
-amazon_feeds_api = ApiObject(secret_dict, 'amazon-feeds', feed_types=constants.amazon_feed_types,
-                             country=constants.amazon_region)
+ebay_trading_api = LazyObject(lambda: ApiObject(secret_dict, 'ebay-trading'))
+ebay_shopping_api = LazyObject(lambda: ApiObject(secret_dict, 'ebay-shopping'))
+amazon_products_api = LazyObject(lambda: ApiObject(secret_dict, 'amazon-products', country=constants.amazon_region))
+amazon_orders_api = LazyObject(lambda: ApiObject(secret_dict, 'amazon-orders', country=constants.amazon_region))
+amazon_feeds_api = LazyObject(lambda: ApiObject(secret_dict, 'amazon-feeds', feed_types=constants.amazon_feed_types,
+                                                country=constants.amazon_region))
 
 # helpers
-xml_quantity_helper = XmlHelper((constants.xml_header_filename, constants.xml_message_quantity_filename),
-                                secret_dict['am_seller_id'], message_type='quantity')
-xml_product_helper = XmlHelper((constants.xml_header_filename, constants.xml_message_product_filename),
-                               secret_dict['am_seller_id'], message_type='product')
-xml_price_helper = XmlHelper((constants.xml_header_filename, constants.xml_message_price_filename),
-                             secret_dict['am_seller_id'], message_type='price')
-xml_delete_product_helper = XmlHelper((constants.xml_header_filename, constants.xml_message_delete_product_filename),
-                                      secret_dict['am_seller_id'], message_type='delete_product')
+xml_quantity_helper = LazyObject(lambda: XmlHelper(
+    (constants.xml_header_filename, constants.xml_message_quantity_filename), secret_dict['am_seller_id'],
+    message_type='quantity'
+))
+xml_product_helper = LazyObject(lambda: XmlHelper(
+    (constants.xml_header_filename, constants.xml_message_product_filename), secret_dict['am_seller_id'],
+    message_type='product'
+))
+xml_price_helper = LazyObject(lambda: XmlHelper(
+    (constants.xml_header_filename, constants.xml_message_price_filename), secret_dict['am_seller_id'],
+    message_type='price'
+))
+xml_delete_product_helper = LazyObject(lambda: XmlHelper(
+    (constants.xml_header_filename, constants.xml_message_delete_product_filename), secret_dict['am_seller_id'],
+    message_type='delete_product'
+))